@@ -0,0 +1,324 @@
+"""Reproducible benchmarks for the borrow database.
+
+    python benchmark.py --rows 100000 --out before.json
+    python benchmark.py --rows 100000 --out after.json
+
+Builds a fresh database in a temporary directory from generated records
+(same seed, same data), times the main operations and prints the results
+as JSON: per benchmark the operation count, wall time, throughput, latency
+percentiles for per-operation timings and the process's peak RSS so far
+(null on Windows, which has no resource module).
+--tracemalloc adds each benchmark's peak Python heap, but slows the timed
+code down about threefold. Compare two runs made with the same flags.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from library_core import (
+    BOOK_MAPPING, DATE_FORMAT, EXPORT_HEADERS, PAGE_SIZE, STORAGE_PROFILE, BackgroundJob,
+    Database, export_records, import_records,
+)
+
+DEFAULT_ROWS = 100000
+DEFAULT_SEED = 1
+MEMBERS_PER_LOAN = 0.05  # distinct members per generated loan
+SINGLE_INSERTS = 1000  # insert_record calls timed one by one
+SEARCHES = 200
+PAGES = 200
+DELETES = 1000
+FETCH_ALL_MAX_ROWS = 1000000  # fetch_all loads everything; skipped above this
+TREE_ROWS = 1000  # rows put in the Treeview (LibraryApp keeps at most MAX_TREE_ROWS)
+
+FIRSTNAMES = ["Amara", "Kofi", "Chidi", "Fatou", "Musa", "Ngozi", "Kwame", "Aisha", "Tunde", "Zainab",
+              "James", "Mary", "John", "Grace", "Samuel", "Esther", "David", "Ruth", "Peter", "Joy"]
+SURNAMES = ["Okafor", "Mensah", "Diallo", "Kamara", "Sankoh", "Johnson", "Doe", "Taylor", "Koroma",
+            "Weah", "Bangura", "Cooper", "Kollie", "Tubman", "Sirleaf", "Mason", "Brown", "Harris"]
+MEMBER_TYPES = ["Student", "Lecturer", "Admin Staff", "Public"]
+TITLES = ["Mr", "Mrs", "Ms", "Dr", "Prof"]
+STREETS = ["Broad Street", "Tubman Boulevard", "Randall Street", "Carey Street", "Benson Street"]
+
+
+def generate_records(count, seed=DEFAULT_SEED):
+    """Yield count realistic record dicts in the Database.csv shape.
+
+    Loans are spread over a pool of members and over the BOOK_MAPPING
+    catalog, with borrow dates across the last three years; about one in
+    ten is overdue and has a date_overdue. The same seed gives the same
+    records.
+    """
+    rng = random.Random(seed)
+    members = []
+    for n in range(max(1, int(count * MEMBERS_PER_LOAN))):
+        members.append({
+            "member_type": rng.choice(MEMBER_TYPES),
+            "reference_no": f"M{n:07d}",
+            "title": rng.choice(TITLES),
+            "firstname": rng.choice(FIRSTNAMES),
+            "surname": rng.choice(SURNAMES),
+            "mobile": f"0{rng.randint(770000000, 889999999)}",
+            "address1": f"{rng.randint(1, 250)} {rng.choice(STREETS)}",
+            "address2": "Monrovia",
+            "postcode": f"{rng.randint(1000, 1099)}",
+        })
+    books = list(BOOK_MAPPING.items())
+    today = datetime.date.today()
+    for _ in range(count):
+        title, info = rng.choice(books)
+        borrowed = today - datetime.timedelta(days=rng.randint(0, 3 * 365))
+        due = borrowed + datetime.timedelta(days=info["days"])
+        overdue = due + datetime.timedelta(days=1) if rng.random() < 0.1 else None
+        yield {
+            **rng.choice(members),
+            "book_id": info["book_id"],
+            "book_title": title,
+            "author": info["author"],
+            "date_borrowed": borrowed.strftime(DATE_FORMAT),
+            "date_due": due.strftime(DATE_FORMAT),
+            "days_on_loan": info["days"],
+            "late_return_fine": info["late_return_fine"],
+            "selling_price": info["selling_price"],
+            "date_overdue": overdue.strftime(DATE_FORMAT) if overdue else "",
+            "created_at": datetime.datetime.combine(borrowed, datetime.time(9)).isoformat(),
+        }
+
+
+def write_csv(path, records):
+    """Write generated records as a Database.csv-style file."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, EXPORT_HEADERS)
+        writer.writeheader()
+        for n, record in enumerate(records, start=1):
+            writer.writerow({"id": n, **record})
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Bench:
+    """Collects one JSON result per timed benchmark."""
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.results = []
+
+    def run(self, name, fn, *args):
+        """Time fn(*args).
+
+        fn returns (ops, latencies): the number of operations it performed
+        and, if it timed them one by one, their durations in seconds.
+        """
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        ops, latencies = fn(*args)
+        seconds = time.perf_counter() - started
+        result = {
+            "name": name,
+            "ops": ops,
+            "seconds": round(seconds, 4),
+            "ops_per_s": round(ops / seconds, 1) if seconds > 0 else None,
+        }
+        if latencies:
+            latencies.sort()
+            result["latency_ms"] = {f"p{pct}": round(_percentile(latencies, pct) * 1000, 3)
+                                    for pct in (50, 90, 99)}
+            result["latency_ms"]["max"] = round(latencies[-1] * 1000, 3)
+        if self.trace_memory:
+            result["peak_python_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+        if resource is None:
+            result["max_rss_kb"] = None
+        else:
+            # ru_maxrss is KiB on Linux, bytes on macOS
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result["max_rss_kb"] = rss // 1024 if sys.platform == "darwin" else rss
+        self.results.append(result)
+        print(f"{name:<16} {ops:>9} ops {seconds:9.3f}s", file=sys.stderr)
+        return result
+
+    def skip(self, name, reason):
+        self.results.append({"name": name, "skipped": reason})
+        print(f"{name:<16} skipped: {reason}", file=sys.stderr)
+
+
+def _timed_each(items, fn):
+    latencies = []
+    for item in items:
+        started = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - started)
+    return len(latencies), latencies
+
+
+def bench_bulk_insert(db, rows, seed):
+    return len(db.insert_many(generate_records(rows, seed))), None
+
+
+def bench_insert_record(db, rows, seed):
+    records = list(generate_records(SINGLE_INSERTS, seed + 1))
+    return _timed_each(records, db.insert_record)
+
+
+def bench_fetch_all(db):
+    return len(db.fetch_all()), None
+
+
+def bench_fetch_page(db, max_id, seed):
+    rng = random.Random(seed)
+    return _timed_each([rng.randint(0, max_id) for _ in range(PAGES)],
+                       lambda after: db.fetch_page(after_id=after, limit=PAGE_SIZE))
+
+
+def bench_search(db, seed):
+    rng = random.Random(seed)
+    titles = list(BOOK_MAPPING)
+    queries = []
+    for n in range(SEARCHES):
+        kind = n % 4
+        if kind == 0:
+            queries.append(rng.choice(FIRSTNAMES))
+        elif kind == 1:
+            queries.append(f"{rng.choice(FIRSTNAMES)} {rng.choice(SURNAMES)[:3]}")
+        elif kind == 2:
+            queries.append(rng.choice(titles).split()[-1][:5])
+        else:
+            queries.append(f"M{rng.randint(0, 999):07d}")
+    return _timed_each(queries, db.search)
+
+
+def bench_delete(db, max_id, seed):
+    rng = random.Random(seed)
+    return _timed_each(rng.sample(range(1, max_id + 1), min(DELETES, max_id)), db.delete_by_id)
+
+
+def bench_export(db_path, csv_path):
+    job = BackgroundJob(export_records, db_path, csv_path)
+    job.run()
+    if job.error:
+        raise job.error
+    return job.result, None
+
+
+def bench_import(db_path, csv_path):
+    job = BackgroundJob(import_records, db_path, csv_path)
+    job.run()
+    if job.error:
+        raise job.error
+    return job.result.read, None
+
+
+def bench_treeview(db):
+    import tkinter as tk
+    from tkinter import ttk
+    root = tk.Tk()
+    try:
+        root.withdraw()
+        columns = ("id", "member", "ref", "name", "mobile", "book_title", "author", "borrowed", "due", "days")
+        tree = ttk.Treeview(root, columns=columns, show="headings")
+        rows = db.fetch_page(limit=TREE_ROWS)
+        result = _timed_each(enumerate(rows, start=1), lambda item: tree.insert(
+            "", "end", iid=str(item[1]["id"]), values=(
+                item[0], item[1]["member_type"], item[1]["reference_no"],
+                f"{item[1]['firstname']} {item[1]['surname']}", item[1]["mobile"],
+                item[1]["book_title"], item[1]["author"], item[1]["date_borrowed"],
+                item[1]["date_due"], item[1]["days_on_loan"])))
+        root.update_idletasks()
+    finally:
+        root.destroy()
+    return result
+
+
+def run_suite(rows, seed, workdir, trace_memory=False):
+    db_path = os.path.join(workdir, "bench.db")
+    csv_path = os.path.join(workdir, "export.csv")
+    bench = Bench(trace_memory)
+    db = Database(db_path)
+    try:
+        bench.run("bulk_insert", bench_bulk_insert, db, rows, seed)
+        bench.run("insert_record", bench_insert_record, db, rows, seed)
+        db.conn.execute("ANALYZE")
+        max_id = db.conn.execute("SELECT MAX(id) FROM loans").fetchone()[0]
+        if rows <= FETCH_ALL_MAX_ROWS:
+            bench.run("fetch_all", bench_fetch_all, db)
+        else:
+            bench.skip("fetch_all", f"more than {FETCH_ALL_MAX_ROWS} rows")
+        bench.run("fetch_page", bench_fetch_page, db, max_id, seed)
+        bench.run("search", bench_search, db, seed)
+        bench.run("export_csv", bench_export, db_path, csv_path)
+        bench.run("import_csv", bench_import, os.path.join(workdir, "import.db"), csv_path)
+        try:
+            bench.run("treeview", bench_treeview, db)
+        except Exception as exc:  # tkinter.TclError without a display
+            bench.skip("treeview", str(exc).splitlines()[0] or type(exc).__name__)
+        bench.run("delete_by_id", bench_delete, db, max_id, seed)
+    finally:
+        db.close()
+    return {
+        "meta": {
+            "rows": rows,
+            "seed": seed,
+            "trace_memory": trace_memory,
+            "storage_profile": STORAGE_PROFILE._asdict(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "started": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": bench.results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the borrow database on generated data.")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="loans to generate (10k to 10M)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--out", help="write the JSON here instead of stdout")
+    parser.add_argument("--workdir", help="directory for the databases and CSV (default: a temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="also report peak Python heap per benchmark (slows the timed code)")
+    parser.add_argument("--generate-csv", metavar="PATH",
+                        help="only write --rows generated records to PATH as CSV and exit")
+    args = parser.parse_args(argv)
+
+    if args.generate_csv:
+        write_csv(args.generate_csv, generate_records(args.rows, args.seed))
+        return 0
+    workdir = args.workdir or tempfile.mkdtemp(prefix="library-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        report = run_suite(args.rows, args.seed, workdir, args.tracemalloc)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""Check that the queries the app runs on every click use an index.
+
+    python check_query_plans.py                  # seed 200k generated loans
+    python check_query_plans.py --db borrow_records.db
+
+Runs each query shape in QUERY_SHAPES through the real Database method on a
+scratch database, captures the statements it issues with SQLite's trace
+callback and runs EXPLAIN QUERY PLAN on each. A shape fails when a plan
+scans loans or the borrow_records view (directly or under an alias) or
+sorts through a temporary b-tree, or when a plan line the shape requires
+(an index a planner hint is there to force) is missing. Prints every plan
+and exits with 1 on any failure, so it can run after each schema change.
+--db checks a copy of an existing database; the original is never written.
+"""
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+from collections import namedtuple
+
+from benchmark import DEFAULT_SEED, generate_records
+from library_core import LIST_COLUMNS, RECORD_COLUMNS, SCHEMA, SORT_KEYS, Database, today_day
+
+DEFAULT_ROWS = 200000
+MAX_LISTED = 1000  # most rows the grid lists at once (main.MAX_TREE_ROWS)
+EXPLAINED_VERBS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+LOAN_TABLES = ("loans", "borrow_records")
+NOT_ALIASES = {"where", "join", "on", "order", "group", "limit", "set", "using", "left", "inner",
+               "cross", "natural", "values", "indexed", "not", "default", "as"}
+TEMP_BTREE = "USE TEMP B-TREE"
+
+# Sample values taken from the seeded data for the shapes to query with.
+Sample = namedtuple("Sample", ["record_id", "reference_no", "surname", "book_title", "record"])
+
+# name, run(db, sample), allowed, required. Each run calls the Database
+# method the app calls, with the arguments the app passes. allowed lists plan
+# lines (by prefix) that are fine for that shape only, each with the reason
+# why; required lists plan lines (by prefix) that must appear in its plans.
+QueryShape = namedtuple("QueryShape", ["name", "run", "allowed", "required"], defaults=((), ()))
+
+# search ranks at most SEARCH_LIMIT exact and FTS hits; sorting those is
+# the ranking itself, not a sort of the table
+RANKED_HITS = ("USE TEMP B-TREE FOR GROUP BY", "USE TEMP B-TREE FOR ORDER BY")
+
+QUERY_SHAPES = [
+    # grid paging (LibraryApp._load_records and scrolling)
+    # walks the rowid from the start and stops after LIMIT rows
+    QueryShape("first page", lambda db, s: db.fetch_page(columns=LIST_COLUMNS), allowed=("SCAN l",)),
+    QueryShape("next page", lambda db, s: db.fetch_page(after_id=s.record_id, columns=LIST_COLUMNS)),
+    QueryShape("previous page", lambda db, s: db.fetch_page(before_id=s.record_id, columns=LIST_COLUMNS)),
+    QueryShape("row still visible", lambda db, s: db.matches(s.record_id)),
+    # reads every record in id order by design (search without FTS5, full listings)
+    QueryShape("fetch all", lambda db, s: db.fetch_all(columns=LIST_COLUMNS), allowed=("SCAN l",)),
+    # heading clicks (LibraryApp.sort_by); a first page walks the sort's index
+    # from one end and stops after LIMIT rows, like the unsorted first page
+    *(QueryShape(f"sorted {how} by {sort}{' desc' if descending else ''}",
+                 lambda db, s, sort=sort, descending=descending, pages=pages:
+                 db.fetch_page(columns=LIST_COLUMNS, sort=sort, descending=descending,
+                               **{key: s.record_id for key in pages}),
+                 () if pages else ("SCAN l USING COVERING INDEX", "SCAN l USING INDEX"))
+      for sort in SORT_KEYS for descending in (False, True)
+      for how, pages in (("first page", ()), ("next page", ("after_id",)), ("previous page", ("before_id",)))),
+    # re-sorting rows already listed orders at most a grid's worth of ids
+    QueryShape("sort listed rows",
+               lambda db, s: db.sort_ids(range(s.record_id, s.record_id + MAX_LISTED), "name"),
+               ("USE TEMP B-TREE FOR ORDER BY",)),
+    # LibraryApp._on_tree_double_click
+    QueryShape("record by id", lambda db, s: db.fetch_by_id(s.record_id)),
+    # search_records: reference number, surname, title words
+    QueryShape("search reference", lambda db, s: db.search(s.reference_no, columns=LIST_COLUMNS), RANKED_HITS),
+    QueryShape("search surname", lambda db, s: db.search(s.surname, columns=LIST_COLUMNS), RANKED_HITS),
+    QueryShape("search title prefix", lambda db, s: db.search(s.book_title[:4], columns=LIST_COLUMNS),
+               RANKED_HITS),
+    # Overdue view
+    QueryShape("overdue first page", lambda db, s: db.fetch_overdue(columns=LIST_COLUMNS)),
+    QueryShape("overdue next page",
+               lambda db, s: db.fetch_overdue(after=(today_day() - 30, s.record_id), columns=LIST_COLUMNS)),
+    QueryShape("overdue since", lambda db, s: db.fetch_overdue(since=today_day() - 1, columns=LIST_COLUMNS)),
+    QueryShape("overdue count", lambda db, s: db.count_overdue()),
+    QueryShape("mark returned", lambda db, s: db.mark_returned(s.record_id)),
+    # add_record / delete_selected
+    QueryShape("insert record", lambda db, s: db.add_record(dict(s.record))),
+    # import_records: the per-row duplicate check (the sample is a duplicate, so
+    # nothing is written); the unary + in _loan_insert_sql must keep it on the
+    # member's loans rather than every loan borrowed that day
+    QueryShape("import duplicate check",
+               lambda db, s: db.insert_unique([tuple(s.record[col] for col in RECORD_COLUMNS)]),
+               required=("SEARCH l USING INDEX idx_loans_member",)),
+    QueryShape("delete record", lambda db, s: db.delete_by_id(s.record_id)),
+]
+
+
+def _loan_aliases(sql):
+    """Names loans and borrow_records go by in sql (and in the view it uses)."""
+    names = set(LOAN_TABLES)
+    for text in (sql, *SCHEMA):
+        for table, alias in re.findall(r"\b(loans|borrow_records)\s+(?:AS\s+)?(\w+)", text, re.I):
+            if alias.lower() not in NOT_ALIASES:
+                names.add(alias)
+    return names
+
+
+def plan_problems(sql, plan, allowed=()):
+    """Plan lines that mean a full scan of the loans or a sort in a temp b-tree."""
+    aliases = _loan_aliases(sql)
+    problems = []
+    for detail in plan:
+        if detail.startswith(tuple(allowed)):
+            continue
+        scan = re.match(r"SCAN (\w+)", detail)
+        if scan and scan.group(1) in aliases and "VIRTUAL TABLE" not in detail:
+            problems.append(detail)
+        elif detail.startswith(TEMP_BTREE):
+            problems.append(detail)
+    return problems
+
+
+def capture(db, run, sample):
+    """Run one shape and return the statements it sent to SQLite."""
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    try:
+        run(db, sample)
+    finally:
+        db.conn.set_trace_callback(None)
+    return [sql for sql in dict.fromkeys(statements) if sql.lstrip().upper().startswith(EXPLAINED_VERBS)]
+
+
+def explain(db, sql):
+    return [detail for _, _, _, detail in db.conn.execute("EXPLAIN QUERY PLAN " + sql)]
+
+
+def pick_sample(db):
+    """A record in the middle of the table with a surname and a title to search for."""
+    low, high = db.conn.execute("SELECT MIN(id), MAX(id) FROM loans").fetchone()
+    if low is None:
+        raise SystemExit("the database has no loans to check against")
+    row = db.fetch_page(after_id=(low + high) // 2, limit=1)[0]
+    record = {key: row[key] for key in row.keys() if key not in ("id", "row_no")}
+    return Sample(row["id"], row["reference_no"], row["surname"], row["book_title"], record)
+
+
+def check(db, shapes=QUERY_SHAPES, out=sys.stdout):
+    """EXPLAIN every statement of every shape; return the number of failing shapes."""
+    sample = pick_sample(db)
+    failed = 0
+    for shape in shapes:
+        problems = []
+        lines = []
+        details = []
+        for sql in capture(db, shape.run, sample):
+            plan = explain(db, sql)
+            bad = plan_problems(sql, plan, shape.allowed)
+            problems.extend(bad)
+            lines.append("    " + " ".join(sql.split())[:160])
+            lines.extend(f"      {'!!' if detail in bad else '  '} {detail}" for detail in plan)
+            details.extend(plan)
+        for line in shape.required:
+            if not any(detail.startswith(line) for detail in details):
+                problems.append(line)
+                lines.append(f"   !! missing {line}")
+        failed += bool(problems)
+        print(f"{'FAIL' if problems else 'ok  '} {shape.name}", file=out)
+        print("\n".join(lines), file=out)
+    return failed
+
+
+def seed(db_path, rows, seed_value):
+    db = Database(db_path)
+    try:
+        db.insert_many(generate_records(rows, seed_value))
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail when a hot query scans the loans or sorts in a temp b-tree.")
+    parser.add_argument("--db", help="check a copy of this database instead of generated data")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="loans to generate")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--analyze", action="store_true",
+                        help="run ANALYZE first (the app itself never does)")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="library-plans-")
+    db_path = os.path.join(workdir, "plans.db")
+    try:
+        if args.db:
+            source = sqlite3.connect(args.db)
+            target = sqlite3.connect(db_path)
+            source.backup(target)
+            source.close()
+            target.close()
+        else:
+            seed(db_path, args.rows, args.seed)
+        db = Database(db_path)
+        try:
+            while db.migrate_step():
+                pass
+            if args.analyze:
+                db.conn.execute("ANALYZE")
+            failed = check(db)
+        finally:
+            db.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"{failed} of {len(QUERY_SHAPES)} query shapes failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Batch jobs on the borrow database from the command line (no GUI needed).
+
+    python library_cli.py search "things fall" > hits.csv
+    python library_cli.py export - | gzip > loans.csv.gz
+    python library_cli.py import new_loans.csv
+    python library_cli.py overdue --date 2025-03-01
+    python library_cli.py fines
+
+Rows go to stdout as CSV, written as they are read, so output of any size
+streams through a pipe; progress and totals go to stderr.
+"""
+import argparse
+import csv
+import datetime
+import os
+import sqlite3
+import sys
+
+from library_core import (
+    DB_FILENAME, EXPORT_CHUNK_SIZE, EXPORT_HEADERS, IMPORT_CHUNK_SIZE, PAGE_SIZE, RECORD_COLUMNS,
+    SEARCH_LIMIT, SQL_STATS, STORAGE_PROFILES, BackgroundJob, Database, day_text, enable_tracing,
+    export_records, import_records, money_text, to_day,
+)
+
+
+def _day(text):
+    day = to_day(text)
+    if day is None:
+        raise argparse.ArgumentTypeError(f"{text!r} is not a YYYY-MM-DD date")
+    return day
+
+
+def _note(message):
+    print(message, file=sys.stderr)
+
+
+# ---------- Commands ----------
+def cmd_search(db, args, out):
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_HEADERS)
+    rows = db.search(args.text, limit=args.limit)
+    writer.writerows([row[col] for col in EXPORT_HEADERS] for row in rows)
+    _note(f"{len(rows)} matches")
+
+
+def cmd_export(db, args, out):
+    if args.file != "-":
+        # same code path as the GUI's Export CSV, run on this thread
+        job = BackgroundJob(export_records, args.db, args.file, args.chunk_size, db.profile)
+        job.run()
+        if job.error:
+            raise job.error
+        _note(f"{job.rows} records written to {args.file}")
+        return
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_HEADERS)
+    count = 0
+    for rows in db.iter_chunks(args.chunk_size):
+        writer.writerows(rows)
+        count += len(rows)
+    _note(f"{count} records")
+
+
+def cmd_import(db, args, out):
+    job = BackgroundJob(import_records, args.db, args.file, args.keep_ids, args.chunk_size, db.profile)
+    job.run()
+    if job.error:
+        raise job.error
+    res = job.result
+    for error in res.errors:
+        _note(error)
+    _note(f"read {res.read}, inserted {res.inserted}, duplicates {res.duplicates}, "
+          f"rejected {res.rejected} in {res.seconds:.1f}s")
+    return 1 if res.rejected else 0
+
+
+def cmd_add(db, args, out):
+    record = dict.fromkeys(RECORD_COLUMNS, "")
+    for pair in args.fields:
+        column, sep, value = pair.partition("=")
+        if not sep or column not in record:
+            raise ValueError(f"expected column=value with a borrow_records column, got {pair!r}")
+        record[column] = value
+    record["days_on_loan"] = int(record["days_on_loan"]) if record["days_on_loan"] else None
+    record["created_at"] = record["created_at"] or datetime.datetime.now().isoformat()
+    print(db.insert_record(record), file=out)
+
+
+def cmd_delete(db, args, out):
+    missing = [record_id for record_id in args.ids if not db.delete_by_id(record_id)]
+    for record_id in missing:
+        _note(f"no record {record_id}")
+    return 1 if missing else 0
+
+
+def cmd_overdue(db, args, out):
+    writer = csv.writer(out)
+    writer.writerow([*EXPORT_HEADERS, "days_late"])
+    after, count = None, 0
+    while True:
+        rows = db.fetch_overdue(args.date, after=after, limit=PAGE_SIZE)
+        writer.writerows([*(row[col] for col in EXPORT_HEADERS), row["days_late"]] for row in rows)
+        count += len(rows)
+        if len(rows) < PAGE_SIZE:
+            break
+        after = (rows[-1]["due_day"], rows[-1]["id"])
+    _note(f"{count} overdue loans")
+
+
+def cmd_fines(db, args, out):
+    fine_run = db.accrue_fines(args.date)
+    writer = csv.writer(out)
+    writer.writerow(["reference_no", "firstname", "surname", "loans", "days_late", "fine"])
+    for member in db.fine_summary(fine_run.day):
+        writer.writerow([*member[:5], money_text(member.fine_cents)])
+    _note(f"{fine_run.loans} overdue loans, {money_text(fine_run.total_cents)} in fines "
+          f"as of {day_text(fine_run.day)} ({fine_run.seconds:.2f}s)")
+
+
+def cmd_migrate(db, args, out):
+    batches = 0
+    while db.migrate_step():
+        batches += 1
+    _note(f"typed columns up to date ({batches} batches converted)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Batch jobs on the library borrow database.")
+    parser.add_argument("--db", default=DB_FILENAME, help=f"database file (default {DB_FILENAME})")
+    parser.add_argument("--profile", choices=sorted(STORAGE_PROFILES),
+                        help="storage profile (default: LIBRARY_STORAGE_PROFILE or single)")
+    parser.add_argument("--trace-sql", action="store_true",
+                        help="print method timings to stderr and log slow statements")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("search", help="ranked search by name, book title or reference")
+    cmd.add_argument("text")
+    cmd.add_argument("--limit", type=int, default=SEARCH_LIMIT)
+    cmd.set_defaults(run=cmd_search)
+
+    cmd = commands.add_parser("export", help="write every record in the Database.csv layout")
+    cmd.add_argument("file", nargs="?", default="-", help="output file, or - for stdout (default)")
+    cmd.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    cmd.set_defaults(run=cmd_export)
+
+    cmd = commands.add_parser("import", help="bulk insert a Database.csv-style file, skipping duplicates")
+    cmd.add_argument("file")
+    cmd.add_argument("--keep-ids", action="store_true", help="keep the file's record IDs")
+    cmd.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    cmd.set_defaults(run=cmd_import)
+
+    cmd = commands.add_parser("add", help="insert one record and print its ID")
+    cmd.add_argument("fields", nargs="+", metavar="column=value")
+    cmd.set_defaults(run=cmd_add)
+
+    cmd = commands.add_parser("delete", help="delete records by ID")
+    cmd.add_argument("ids", nargs="+", type=int, metavar="id")
+    cmd.set_defaults(run=cmd_delete)
+
+    cmd = commands.add_parser("overdue", help="list loans past due and not returned")
+    cmd.add_argument("--date", type=_day, help="as of this YYYY-MM-DD date (default today)")
+    cmd.set_defaults(run=cmd_overdue)
+
+    cmd = commands.add_parser("fines", help="accrue fines on overdue loans and print a per-member summary")
+    cmd.add_argument("--date", type=_day, help="as of this YYYY-MM-DD date (default today)")
+    cmd.set_defaults(run=cmd_fines)
+
+    cmd = commands.add_parser("migrate", help="finish converting old dates and money to typed columns")
+    cmd.set_defaults(run=cmd_migrate)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.trace_sql:
+        enable_tracing()
+    db = Database(args.db, STORAGE_PROFILES[args.profile] if args.profile else None)
+    try:
+        return args.run(db, args, sys.stdout) or 0
+    except BrokenPipeError:
+        # reader went away (e.g. piped into head); not an error for a batch job,
+        # but stop Python complaining again when it flushes stdout at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except (OSError, ValueError, sqlite3.Error) as exc:
+        _note(f"error: {exc}")
+        return 1
+    finally:
+        db.close()
+        if SQL_STATS.enabled:
+            SQL_STATS.report()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1889 @@
+"""Library records without the GUI: storage, loan operations and batch jobs.
+
+main.py builds the Tk app on top of this module; library_cli.py runs the
+same operations from the command line, so nothing here may import tkinter.
+"""
+import time
+import sqlite3
+import hashlib
+import datetime
+import csv
+import os
+import sys
+import bisect
+import decimal
+import functools
+import itertools
+import math
+import queue
+import re
+import threading
+import unicodedata
+from concurrent.futures import Future
+from collections import OrderedDict, deque, namedtuple
+
+# =========================
+# CONFIG & DATA
+# =========================
+DATE_FORMAT = "%Y-%m-%d"
+DB_USERS = "users.db"
+DB_BORROW = "borrow_records.db"
+
+
+# =========================
+# STORAGE PROFILE
+# =========================
+# How every connection the app opens is configured. Sizes are in KiB/bytes,
+# lock_retries/retry_backoff_s apply on top of SQLite's own busy timeout.
+# journal_mode is stored in the database file: "WAL" switches a file over
+# on open, while the rollback profiles keep whatever mode the file already
+# has (take a file out of WAL with PRAGMA journal_mode = DELETE once every
+# desk has closed it).
+StorageProfile = namedtuple("StorageProfile", [
+    "journal_mode", "synchronous", "busy_timeout_ms", "cache_size_kb", "mmap_size",
+    "lock_retries", "retry_backoff_s",
+])
+
+STORAGE_PROFILES = {
+    # Several desk terminals on one machine or a shared local disk: readers
+    # and the writer no longer block each other. WAL needs shared memory, so
+    # it does not work when the files sit on an SMB/NFS network share.
+    "shared": StorageProfile("WAL", "NORMAL", 5000, 16384, 64 * 1024 * 1024, 5, 0.05),
+    # Files on a network share: rollback journal, but wait and retry on locks.
+    "network": StorageProfile("DELETE", "FULL", 10000, 8192, 0, 8, 0.1),
+    # SQLite's defaults (what the app used originally).
+    "single": StorageProfile("DELETE", "FULL", 5000, 2000, 0, 0, 0.0),
+}
+
+# Chosen with the LIBRARY_STORAGE_PROFILE environment variable. The default
+# keeps the rollback journal, which is safe wherever the files live; WAL
+# ("shared") is opt-in because it persists in the file once switched on.
+STORAGE_PROFILE = STORAGE_PROFILES[os.environ.get("LIBRARY_STORAGE_PROFILE", "single")]
+
+
+def connect(db_path, profile=None):
+    """Open a SQLite connection configured by a StorageProfile."""
+    profile = profile or STORAGE_PROFILE
+    conn = sqlite3.connect(db_path, timeout=profile.busy_timeout_ms / 1000)
+    # the journal mode persists in the file, so only switch it on for WAL:
+    # forcing it back would need exclusive access, which another desk's open
+    # connection denies. Switching needs a moment of exclusive access too.
+    if profile.journal_mode == "WAL" and conn.execute("PRAGMA journal_mode").fetchone()[0].upper() != "WAL":
+        with_retry(conn.execute, "PRAGMA journal_mode = WAL", profile=profile)
+    conn.execute(f"PRAGMA synchronous = {profile.synchronous}")
+    conn.execute(f"PRAGMA cache_size = -{profile.cache_size_kb}")
+    conn.execute(f"PRAGMA mmap_size = {profile.mmap_size}")
+    if SQL_STATS.enabled:
+        conn.set_trace_callback(SQL_STATS.statement)
+    return conn
+
+
+def with_retry(fn, *args, profile=None, **kwargs):
+    """Call fn, retrying with exponential backoff while the database is locked.
+
+    SQLite's busy timeout covers most waits, but some conflicts (a reader
+    upgrading to a writer under WAL, for one) fail immediately with
+    "database is locked"; those are worth a short wait and another try.
+    fn must leave no half-done transaction behind when it raises.
+    """
+    profile = profile or STORAGE_PROFILE
+    delay = profile.retry_backoff_s
+    for attempt in range(profile.lock_retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except sqlite3.OperationalError as exc:
+            locked = "locked" in str(exc) or "busy" in str(exc)
+            if not locked or attempt == profile.lock_retries:
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+
+# =========================
+# STARTUP TIMING
+# =========================
+# enable_startup_timing() (main.py --timing, or LIBRARY_STARTUP_TIMING=1)
+# prints how long each startup step took, measured from when this module
+# was loaded.
+_startup_t0 = time.perf_counter()
+STARTUP_TIMING = bool(os.environ.get("LIBRARY_STARTUP_TIMING"))
+_startup_marks = []  # (step, seconds since _startup_t0); appended from any thread
+
+
+def enable_startup_timing():
+    """Record the startup steps marked from now on and report them."""
+    global STARTUP_TIMING
+    STARTUP_TIMING = True
+
+
+def mark_startup(step):
+    """Note that a startup step just finished (does nothing unless STARTUP_TIMING)."""
+    if STARTUP_TIMING:
+        _startup_marks.append((step, time.perf_counter() - _startup_t0))
+
+
+def report_startup():
+    """Print the startup steps noted so far to stderr, once."""
+    if not STARTUP_TIMING or not _startup_marks:
+        return
+    previous = 0.0
+    for step, at in sorted(_startup_marks, key=lambda mark: mark[1]):
+        print(f"{step:<22} {at * 1000:8.1f} ms  (+{(at - previous) * 1000:.1f})", file=sys.stderr)
+        previous = at
+    _startup_marks.clear()
+
+
+def finish_startup(step):
+    """Mark the last startup step and print the report; later calls do nothing."""
+    if _startup_marks:
+        mark_startup(step)
+        report_startup()
+
+
+# =========================
+# INSTRUMENTATION
+# =========================
+# enable_tracing() (the --trace-sql option, or LIBRARY_TRACE_SQL=1) times the
+# Database and UserDatabase methods marked @traced, traces every SQL
+# statement on connections opened afterwards and logs the slow ones with
+# their query plans. Until then the methods are not wrapped and no trace
+# callback is installed, so it costs nothing.
+TRACE_SQL = bool(os.environ.get("LIBRARY_TRACE_SQL"))
+SLOW_QUERY_MS = float(os.environ.get("LIBRARY_SLOW_QUERY_MS", 50))  # statements slower than this are logged
+SLOW_QUERY_LOG = os.environ.get("LIBRARY_SLOW_QUERY_LOG", "slow_queries.log")
+RECENT_STATEMENTS = 200  # last statements kept by SqlStats for inspection
+HISTOGRAM_BUCKETS = 80  # quarter-octave buckets from 0.01 ms (up to about 10 min)
+EXPLAINED_VERBS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class LatencyHistogram:
+    """Call durations in log-spaced buckets, each a quarter octave wide.
+
+    Recording is O(1) and the memory is fixed however many calls there are;
+    percentiles come back as the upper edge of the bucket they fall in, so
+    they are accurate to about 19%.
+    """
+
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        bucket = int(4 * math.log2(ms / 0.01)) + 1 if ms > 0.01 else 0
+        self.counts[min(bucket, HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        """Duration in seconds that `fraction` of the calls finished within."""
+        if not self.count:
+            return 0.0
+        wanted = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if seen >= wanted:
+                return min(0.01 * 2 ** (bucket / 4) / 1000, self.max)
+        return self.max
+
+
+MethodTiming = namedtuple("MethodTiming", ["name", "calls", "p50", "p99", "max", "total"])
+
+
+class _TracedCall:
+    """The statement running inside a traced method and the slow ones so far."""
+    __slots__ = ("started", "sql", "slow")
+
+    def __init__(self):
+        self.started = None
+        self.sql = None
+        self.slow = []  # (seconds, sql)
+
+    def next(self, sql, now):
+        # statements on one connection run one after another, so each one
+        # lasts until the next starts (or the method returns)
+        if self.sql is not None and (now - self.started) * 1000 >= SLOW_QUERY_MS:
+            self.slow.append((now - self.started, self.sql))
+        self.started, self.sql = now, sql
+
+
+class SqlStats:
+    """Timings shared by every traced connection in the process (any thread)."""
+
+    def __init__(self):
+        self.enabled = False  # set by enable_tracing
+        self._lock = threading.Lock()
+        self._methods = {}  # "Database.fetch_all" -> LatencyHistogram
+        self._local = threading.local()  # the traced call running on this thread
+        self.statements = 0
+        self.recent = deque(maxlen=RECENT_STATEMENTS)
+        self.slow = 0
+
+    def statement(self, sql):
+        """sqlite3 trace callback: note a statement as it starts running."""
+        self.statements += 1
+        self.recent.append(sql)
+        call = getattr(self._local, "call", None)
+        # a trigger program reports its parent statement again; that is not a new one
+        if call is not None and sql != call.sql:
+            call.next(sql, time.perf_counter())
+
+    def record(self, name, seconds):
+        with self._lock:
+            histogram = self._methods.get(name)
+            if histogram is None:
+                histogram = self._methods[name] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def timings(self):
+        """MethodTiming for every method called so far, busiest first."""
+        with self._lock:
+            timings = [MethodTiming(name, h.count, h.percentile(0.5), h.percentile(0.99), h.max, h.total)
+                       for name, h in self._methods.items()]
+        return sorted(timings, key=lambda t: t.total, reverse=True)
+
+    def report(self, out=None):
+        """Print a table of method timings (in ms) to out, stderr by default."""
+        out = out or sys.stderr
+        print(f"{'method':<30} {'calls':>7} {'p50':>9} {'p99':>9} {'max':>9}", file=out)
+        for t in self.timings():
+            print(f"{t.name:<30} {t.calls:>7} {t.p50 * 1000:9.2f} {t.p99 * 1000:9.2f} {t.max * 1000:9.2f}",
+                  file=out)
+        print(f"{self.statements} statements, {self.slow} slower than {SLOW_QUERY_MS:g} ms "
+              f"(see {SLOW_QUERY_LOG})", file=out)
+
+    def _begin(self):
+        if getattr(self._local, "call", None) is not None:
+            return False  # nested: the outer call owns the statements
+        self._local.call = _TracedCall()
+        return True
+
+    def _end(self, name, conn, finished):
+        call, self._local.call = self._local.call, None
+        call.next(None, finished)
+        for seconds, sql in call.slow:
+            self._log_slow(name, conn, seconds, sql)
+
+    def _log_slow(self, name, conn, seconds, sql):
+        plan = []
+        if sql.lstrip().upper().startswith(EXPLAINED_VERBS):
+            try:
+                plan = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+            except sqlite3.Error as exc:
+                plan = [(0, 0, 0, f"(no plan: {exc})")]
+        lines = [f"{datetime.datetime.now().isoformat(timespec='seconds')} {name} "
+                 f"{seconds * 1000:.1f} ms", "    " + " ".join(sql.split())]
+        depth = {0: 0}
+        for node, parent, _, detail in plan:
+            depth[node] = depth.get(parent, 0) + 1
+            lines.append("    " + "  " * depth[node] + detail)
+        with self._lock:
+            self.slow += 1
+            with open(SLOW_QUERY_LOG, "a", encoding="utf-8") as log:
+                log.write("\n".join(lines) + "\n")
+
+
+SQL_STATS = SqlStats()
+
+
+def traced(method):
+    """Mark a connection-owning method (the class must have .conn) to be
+    timed once enable_tracing is called. Returns the method itself."""
+    method.traced = True
+    return method
+
+
+def _timed(method):
+    name = method.__qualname__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        outer = SQL_STATS._begin()
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            finished = time.perf_counter()
+            SQL_STATS.record(name, finished - started)
+            if outer:
+                SQL_STATS._end(name, self.conn, finished)
+    return wrapper
+
+
+def enable_tracing():
+    """Wrap the @traced methods and trace connections opened from now on."""
+    if SQL_STATS.enabled:
+        return
+    SQL_STATS.enabled = True
+    for cls in (UserDatabase, Database):
+        for name, method in list(vars(cls).items()):
+            if getattr(method, "traced", False):
+                setattr(cls, name, _timed(method))
+
+
+# =========================
+# USER DATABASE
+# =========================
+class UserDatabase:
+    def __init__(self, db_path=DB_USERS, profile=None):
+        self.profile = profile or STORAGE_PROFILE
+        self.conn = connect(db_path, self.profile)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE,
+                password TEXT
+            )
+        """)
+        self.conn.commit()
+
+    def hash_password(self, password):
+        return hashlib.sha256(password.encode()).hexdigest()
+
+    @traced
+    def add_user(self, username, password):
+        def insert():
+            try:
+                self.conn.execute("INSERT INTO users (username, password) VALUES (?, ?)",
+                                  (username, self.hash_password(password)))
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+        try:
+            with_retry(insert, profile=self.profile)
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    @traced
+    def validate_user(self, username, password):
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM users WHERE username=? AND password=?",
+                    (username, self.hash_password(password)))
+        return cur.fetchone() is not None
+
+    def close(self):
+        self.conn.close()
+
+
+# =========================
+# BOOK DATA
+# =========================
+# Starting catalog, copied into the books table of a new database. At run
+# time the app reads the catalog from that table, not from here.
+BOOK_MAPPING = {
+    "Cinderella": {"book_id": "ISBN-101", "author": "Paul Parker", "late_return_fine": "2.99", "selling_price": "9.95", "days": 14},
+    
+    "Game Design": {"book_id": "ISBN-102", "author": "James Ford", "late_return_fine": "3.50", "selling_price": "12.95", "days": 12},
+    
+    "Ancient Rome": {"book_id": "ISBN-103", "author": "Julia White", "late_return_fine": "2.30", "selling_price": "10.99", "days": 10},
+
+    "Sundown at Dawn: A Liberian Odyssey": {"book_id": "ISBN-104", "author": "Wilton G. S. Sankawulo", "late_return_fine": "3.00", "selling_price": "15.00", "days": 14},
+    
+    "The Rain and the Night": {"book_id": "ISBN-105", "author": "Wilton G. S. Sankawulo", "late_return_fine": "3.00", "selling_price": "14.00", "days": 14},
+    
+    "Why Nobody Knows When He Will Die and Other Stories": {"book_id": "ISBN-106", "author": "Wilton G. S. Sankawulo", "late_return_fine": "2.00", "selling_price": "14.00", "days": 14},
+    
+    "Things Fall Apart": {"book_id": "ISBN-107", "author": "Chinua Achebe", "late_return_fine": "3.50", "selling_price": "18.00", "days": 14},
+    
+    "Arrow of God": {"book_id": "ISBN-108", "author": "Chinua Achebe", "late_return_fine": "3.50", "selling_price": "17.00", "days": 14},
+    
+    "Nervous Conditions": {"book_id": "ISBN-109", "author": "Tsitsi Dangarembga", "late_return_fine": "3.00", "selling_price": "16.50", "days": 14},
+    
+    "So Long a Letter": {"book_id": "ISBN-1010", "author": "Mariama Bâ", "late_return_fine": "2.50", "selling_price": "14.50", "days": 14},
+    
+    "The Beautyful Ones Are Not Yet Born": {"book_id": "ISBN-1011", "author": "Ayi Kwei Armah", "late_return_fine": "3.50", "selling_price": "18.50", "days": 14},
+    
+    "Season of Migration to the North": {"book_id": "ISBN-1012", "author": "Tayeb Salih", "late_return_fine": "3.50", "selling_price": "19.00", "days": 14},
+    
+    "Petals of Blood": {"book_id": "ISBN-1013", "author": "Ngũgĩ wa Thiong’o", "late_return_fine": "4.00", "selling_price": "20.00", "days": 14},
+    
+    "Weep Not, Child": {"book_id": "ISBN-1014", "author": "Ngũgĩ wa Thiong’o", "late_return_fine": "3.50", "selling_price": "17.50", "days": 14},
+    
+    "The Palm-Wine Drinkard": {"book_id": "ISBN-1015", "author": "Amos Tutuola", "late_return_fine": "2.50", "selling_price": "13.50", "days": 14},
+    
+    "Purple Hibiscus": {"book_id": "ISBN-1016", "author": "Chimamanda Ngozi Adichie", "late_return_fine": "3.50", "selling_price": "19.00", "days": 14},
+    
+    "The Joys of Motherhood": {"book_id": "ISBN-1017", "author": "Buchi Emecheta", "late_return_fine": "3.00", "selling_price": "16.00", "days": 14}
+}
+
+# =========================
+# DATABASE LAYER
+# =========================
+DB_FILENAME = "borrow_records.db"
+INSERT_CHUNK_SIZE = 1000  # rows per transaction in insert_many
+
+# Every borrow_records column except the SQLite-assigned id, in table order
+RECORD_COLUMNS = (
+    "member_type", "reference_no", "title", "firstname", "surname", "mobile",
+    "address1", "address2", "postcode", "book_id", "book_title", "author",
+    "date_borrowed", "date_due", "days_on_loan", "late_return_fine",
+    "selling_price", "date_overdue", "created_at",
+)
+
+SEARCH_LIMIT = 500  # max rows returned by a search
+SEARCH_CACHE_SIZE = 32  # recent search results kept by a SearchCache
+SEARCH_CACHE_MAX_AGE_S = 30  # bounds staleness from writes made by other terminals
+CATALOG_MATCHES = 100  # titles shown by the book picker
+PAGE_SIZE = 200  # rows per keyset page in fetch_page
+EXPORT_CHUNK_SIZE = 2000  # rows per fetchmany while exporting
+EXPORT_HEADERS = ["id", *RECORD_COLUMNS]  # same layout as Database.csv
+# What the record grid shows (and search narrowing needs); list queries
+# select only these and the full record is fetched by id when opened
+LIST_COLUMNS = ("id", "member_type", "reference_no", "firstname", "surname", "mobile",
+                "book_title", "author", "date_borrowed", "date_due", "days_on_loan")
+# Grid columns fetch_page can sort by: the tables to walk (outer first) and
+# the key rows are ordered by, ending in the loan id so it is unique. Every
+# step of a key is index order: members (surname, firstname) or books
+# (title) / (author, title), then that member's or book's loans through
+# idx_loans_member / idx_loans_book, or a date index on loans. CROSS JOIN
+# and INDEXED BY pin that plan, whatever ANALYZE statistics say.
+SortKey = namedtuple("SortKey", ["tables", "key"])
+SORT_KEYS = {
+    "name": SortKey("members m INDEXED BY idx_members_name CROSS JOIN loans l ON l.member_ref = m.id",
+                    ("m.surname", "m.firstname", "m.id", "l.borrowed_day", "l.id")),
+    "book_title": SortKey("books b INDEXED BY idx_books_title CROSS JOIN loans l ON l.book_ref = b.id",
+                          ("b.title", "b.id", "l.id")),
+    "author": SortKey("books b INDEXED BY idx_books_author CROSS JOIN loans l ON l.book_ref = b.id",
+                      ("b.author", "b.title", "b.id", "l.id")),
+    "date_borrowed": SortKey("loans l INDEXED BY idx_loans_borrowed", ("l.borrowed_day", "l.id")),
+    "date_due": SortKey("loans l INDEXED BY idx_loans_due", ("l.due_day", "l.id")),
+}
+SORT_INDEXES = ("idx_members_name", "idx_books_author")  # created by SCHEMA for SORT_KEYS
+NULLABLE_SORT_COLUMNS = ("l.borrowed_day", "l.due_day")  # NULL for a date that did not parse
+ROW_STORE_BUDGET = 16 * 1024 * 1024  # bytes of records a RowStore keeps for the grid
+# text that repeats across loans, interned by GridRow so equal values share memory
+INTERNED_COLUMNS = frozenset(("member_type", "title", "firstname", "surname", "book_id", "book_title",
+                              "author", "date_borrowed", "date_due", "late_return_fine", "selling_price",
+                              "date_overdue"))
+IMPORT_CHUNK_SIZE = 20000  # rows per transaction while importing
+
+# borrow_records used to be one wide table repeating the member's details
+# and the book's details on every loan. Members and books now live in their
+# own tables and loans point at them by integer key. borrow_records is a view
+# with the original 20 columns, so reads and exports are unchanged.
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY,
+        isbn TEXT NOT NULL DEFAULT '',
+        title TEXT NOT NULL DEFAULT '',
+        author TEXT NOT NULL DEFAULT '',
+        late_return_fine TEXT NOT NULL DEFAULT '',
+        selling_price TEXT NOT NULL DEFAULT '',
+        loan_days INTEGER,
+        fine_cents INTEGER,
+        price_cents INTEGER,
+        UNIQUE (isbn, title, author)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_books_title ON books (title)",
+    "CREATE INDEX IF NOT EXISTS idx_books_author ON books (author, title)",
+    """
+    CREATE TABLE IF NOT EXISTS members (
+        id INTEGER PRIMARY KEY,
+        member_type TEXT NOT NULL DEFAULT '',
+        reference_no TEXT NOT NULL DEFAULT '',
+        title TEXT NOT NULL DEFAULT '',
+        firstname TEXT NOT NULL DEFAULT '',
+        surname TEXT NOT NULL DEFAULT '',
+        mobile TEXT NOT NULL DEFAULT '',
+        address1 TEXT NOT NULL DEFAULT '',
+        address2 TEXT NOT NULL DEFAULT '',
+        postcode TEXT NOT NULL DEFAULT '',
+        UNIQUE (reference_no, firstname, surname, member_type, title, mobile,
+                address1, address2, postcode)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_members_name ON members (surname, firstname)",
+    # Dates are day numbers (days since 1970-01-01) and money is integer
+    # cents. The matching TEXT column only keeps a value that could not be
+    # parsed, or one the background migration has not converted yet. A
+    # loan's fine/price are NULL unless they differ from the book's.
+    """
+    CREATE TABLE IF NOT EXISTS loans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        member_ref INTEGER NOT NULL REFERENCES members (id),
+        book_ref INTEGER NOT NULL REFERENCES books (id),
+        date_borrowed TEXT,
+        date_due TEXT,
+        days_on_loan INTEGER,
+        late_return_fine TEXT,
+        selling_price TEXT,
+        date_overdue TEXT,
+        created_at TEXT,
+        borrowed_day INTEGER,
+        due_day INTEGER,
+        overdue_day INTEGER,
+        fine_cents INTEGER,
+        price_cents INTEGER,
+        returned_day INTEGER,
+        accrued_fine_cents INTEGER,
+        accrued_day INTEGER
+    )
+    """,
+    # member's loans by date; also the import duplicate check
+    "CREATE INDEX IF NOT EXISTS idx_loans_member ON loans (member_ref, borrowed_day)",
+    "CREATE INDEX IF NOT EXISTS idx_loans_book ON loans (book_ref)",
+    "CREATE INDEX IF NOT EXISTS idx_loans_due ON loans (due_day)",
+    "CREATE INDEX IF NOT EXISTS idx_loans_borrowed ON loans (borrowed_day)",
+    # loans still out, by due date: the Overdue view (returned_day IS NULL = not back yet)
+    "CREATE INDEX IF NOT EXISTS idx_loans_overdue ON loans (due_day, id) WHERE returned_day IS NULL",
+    """
+    CREATE VIEW IF NOT EXISTS borrow_records AS
+    SELECT l.id, m.member_type, m.reference_no, m.title, m.firstname, m.surname,
+           m.mobile, m.address1, m.address2, m.postcode,
+           b.isbn AS book_id, b.title AS book_title, b.author,
+           COALESCE(date(l.borrowed_day * 86400, 'unixepoch'), l.date_borrowed) AS date_borrowed,
+           COALESCE(date(l.due_day * 86400, 'unixepoch'), l.date_due) AS date_due,
+           l.days_on_loan,
+           COALESCE(CASE WHEN l.fine_cents IS NOT NULL THEN printf('%.2f', l.fine_cents / 100.0) END,
+                    l.late_return_fine,
+                    CASE WHEN b.fine_cents IS NOT NULL THEN printf('%.2f', b.fine_cents / 100.0) END,
+                    b.late_return_fine) AS late_return_fine,
+           COALESCE(CASE WHEN l.price_cents IS NOT NULL THEN printf('%.2f', l.price_cents / 100.0) END,
+                    l.selling_price,
+                    CASE WHEN b.price_cents IS NOT NULL THEN printf('%.2f', b.price_cents / 100.0) END,
+                    b.selling_price) AS selling_price,
+           COALESCE(date(l.overdue_day * 86400, 'unixepoch'), l.date_overdue) AS date_overdue,
+           l.created_at
+    FROM loans l
+    JOIN members m ON m.id = l.member_ref
+    JOIN books b ON b.id = l.book_ref
+    """,
+    # progress of the batched TEXT -> typed column migration (migrate_step)
+    """
+    CREATE TABLE IF NOT EXISTS schema_progress (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL DEFAULT 0,
+        done INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "INSERT OR IGNORE INTO schema_progress (name) VALUES ('books'), ('loans')",
+)
+
+# Adds the typed columns to a database created before they existed; the
+# values themselves are converted later by migrate_step, in batches
+TYPED_UPGRADE = (
+    "ALTER TABLE books ADD COLUMN fine_cents INTEGER",
+    "ALTER TABLE books ADD COLUMN price_cents INTEGER",
+    "ALTER TABLE loans ADD COLUMN borrowed_day INTEGER",
+    "ALTER TABLE loans ADD COLUMN due_day INTEGER",
+    "ALTER TABLE loans ADD COLUMN overdue_day INTEGER",
+    "ALTER TABLE loans ADD COLUMN fine_cents INTEGER",
+    "ALTER TABLE loans ADD COLUMN price_cents INTEGER",
+    "DROP INDEX IF EXISTS idx_loans_member",
+    "DROP VIEW IF EXISTS borrow_records",
+)
+RETURNS_UPGRADE = ("ALTER TABLE loans ADD COLUMN returned_day INTEGER",)
+FINES_UPGRADE = (
+    "ALTER TABLE loans ADD COLUMN accrued_fine_cents INTEGER",
+    "ALTER TABLE loans ADD COLUMN accrued_day INTEGER",
+)
+# (column, statements adding it) for loans tables created before the column
+LOAN_UPGRADES = (
+    ("due_day", TYPED_UPGRADE),
+    ("returned_day", RETURNS_UPGRADE),
+    ("accrued_fine_cents", FINES_UPGRADE),
+)
+
+# Daily late fine of a loan in cents, for use inside an UPDATE on loans: the
+# loan's own rate, else its book's. A blank loan rate is no override; an
+# unparsed one gives NULL.
+FINE_RATE_SQL = """
+    CASE WHEN fine_cents IS NOT NULL THEN fine_cents
+         WHEN NULLIF(late_return_fine, '') IS NULL THEN (SELECT b.fine_cents FROM books b WHERE b.id = loans.book_ref)
+    END"""
+
+# One-time migration of a pre-normalization borrow_records table
+LEGACY_PREPARE = (
+    "DROP TRIGGER IF EXISTS borrow_records_fts_ai",
+    "DROP TRIGGER IF EXISTS borrow_records_fts_ad",
+    "DROP TRIGGER IF EXISTS borrow_records_fts_au",
+    "DROP TABLE IF EXISTS borrow_records_fts",
+    "DROP INDEX IF EXISTS idx_borrow_records_ref",
+    "DROP INDEX IF EXISTS idx_borrow_records_loan_key",
+    "ALTER TABLE borrow_records RENAME TO borrow_records_legacy",
+)
+LEGACY_COPY = (
+    """
+    INSERT OR IGNORE INTO books (isbn, title, author, late_return_fine, selling_price, loan_days)
+    SELECT COALESCE(book_id, ''), COALESCE(book_title, ''), COALESCE(author, ''),
+           COALESCE(late_return_fine, ''), COALESCE(selling_price, ''), days_on_loan
+    FROM borrow_records_legacy ORDER BY id
+    """,
+    """
+    INSERT OR IGNORE INTO members (member_type, reference_no, title, firstname, surname,
+                                   mobile, address1, address2, postcode)
+    SELECT COALESCE(member_type, ''), COALESCE(reference_no, ''), COALESCE(title, ''),
+           COALESCE(firstname, ''), COALESCE(surname, ''), COALESCE(mobile, ''),
+           COALESCE(address1, ''), COALESCE(address2, ''), COALESCE(postcode, '')
+    FROM borrow_records_legacy ORDER BY id
+    """,
+    """
+    INSERT INTO loans (id, member_ref, book_ref, date_borrowed, date_due, days_on_loan,
+                       late_return_fine, selling_price, date_overdue, created_at)
+    SELECT r.id, m.id, b.id, r.date_borrowed, r.date_due, r.days_on_loan,
+           NULLIF(COALESCE(r.late_return_fine, ''),
+                  CASE WHEN b.fine_cents IS NOT NULL THEN printf('%.2f', b.fine_cents / 100.0)
+                       ELSE b.late_return_fine END),
+           NULLIF(COALESCE(r.selling_price, ''),
+                  CASE WHEN b.price_cents IS NOT NULL THEN printf('%.2f', b.price_cents / 100.0)
+                       ELSE b.selling_price END),
+           r.date_overdue, r.created_at
+    FROM borrow_records_legacy r
+    JOIN members m ON (m.reference_no, m.firstname, m.surname, m.member_type, m.title,
+                       m.mobile, m.address1, m.address2, m.postcode)
+                    = (COALESCE(r.reference_no, ''), COALESCE(r.firstname, ''),
+                       COALESCE(r.surname, ''), COALESCE(r.member_type, ''),
+                       COALESCE(r.title, ''), COALESCE(r.mobile, ''),
+                       COALESCE(r.address1, ''), COALESCE(r.address2, ''),
+                       COALESCE(r.postcode, ''))
+    JOIN books b ON (b.isbn, b.title, b.author)
+                  = (COALESCE(r.book_id, ''), COALESCE(r.book_title, ''), COALESCE(r.author, ''))
+    """,
+    "DROP TABLE borrow_records_legacy",
+)
+
+# Full-text index over the searchable columns. Its content is the
+# borrow_records view; triggers on the base tables keep it in sync.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS borrow_records_fts USING fts5(
+    firstname, surname, book_title, reference_no,
+    content='borrow_records', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS loans_fts_ai AFTER INSERT ON loans BEGIN
+    INSERT INTO borrow_records_fts (rowid, firstname, surname, book_title, reference_no)
+    SELECT new.id, m.firstname, m.surname, b.title, m.reference_no
+    FROM members m, books b WHERE m.id = new.member_ref AND b.id = new.book_ref;
+END;
+CREATE TRIGGER IF NOT EXISTS loans_fts_ad AFTER DELETE ON loans BEGIN
+    INSERT INTO borrow_records_fts (borrow_records_fts, rowid, firstname, surname, book_title, reference_no)
+    SELECT 'delete', old.id, m.firstname, m.surname, b.title, m.reference_no
+    FROM members m, books b WHERE m.id = old.member_ref AND b.id = old.book_ref;
+END;
+CREATE TRIGGER IF NOT EXISTS loans_fts_au AFTER UPDATE OF member_ref, book_ref ON loans BEGIN
+    INSERT INTO borrow_records_fts (borrow_records_fts, rowid, firstname, surname, book_title, reference_no)
+    SELECT 'delete', old.id, m.firstname, m.surname, b.title, m.reference_no
+    FROM members m, books b WHERE m.id = old.member_ref AND b.id = old.book_ref;
+    INSERT INTO borrow_records_fts (rowid, firstname, surname, book_title, reference_no)
+    SELECT new.id, m.firstname, m.surname, b.title, m.reference_no
+    FROM members m, books b WHERE m.id = new.member_ref AND b.id = new.book_ref;
+END;
+CREATE TRIGGER IF NOT EXISTS members_fts_au AFTER UPDATE OF firstname, surname, reference_no ON members BEGIN
+    INSERT INTO borrow_records_fts (borrow_records_fts, rowid, firstname, surname, book_title, reference_no)
+    SELECT 'delete', l.id, old.firstname, old.surname, b.title, old.reference_no
+    FROM loans l JOIN books b ON b.id = l.book_ref WHERE l.member_ref = old.id;
+    INSERT INTO borrow_records_fts (rowid, firstname, surname, book_title, reference_no)
+    SELECT l.id, new.firstname, new.surname, b.title, new.reference_no
+    FROM loans l JOIN books b ON b.id = l.book_ref WHERE l.member_ref = new.id;
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title ON books BEGIN
+    INSERT INTO borrow_records_fts (borrow_records_fts, rowid, firstname, surname, book_title, reference_no)
+    SELECT 'delete', l.id, m.firstname, m.surname, old.title, m.reference_no
+    FROM loans l JOIN members m ON m.id = l.member_ref WHERE l.book_ref = old.id;
+    INSERT INTO borrow_records_fts (rowid, firstname, surname, book_title, reference_no)
+    SELECT l.id, m.firstname, m.surname, new.title, m.reference_no
+    FROM loans l JOIN members m ON m.id = l.member_ref WHERE l.book_ref = new.id;
+END;
+"""
+
+MEMBER_COLUMNS = ("member_type", "reference_no", "title", "firstname", "surname",
+                  "mobile", "address1", "address2", "postcode")
+LOAN_COLUMNS = ("member_ref", "book_ref", "borrowed_day", "date_borrowed", "due_day", "date_due",
+                "days_on_loan", "fine_cents", "late_return_fine", "price_cents", "selling_price",
+                "overdue_day", "date_overdue", "created_at")
+MAX_CACHED_REFS = 100000  # member/book keys remembered by a Database
+MIGRATION_BATCH_SIZE = 2000  # rows converted per migrate_step transaction
+EPOCH = datetime.date(1970, 1, 1)
+
+
+@functools.lru_cache(maxsize=4096)
+def to_day(text):
+    """Day number (days since 1970-01-01) of a DATE_FORMAT date, or None."""
+    try:
+        return (datetime.datetime.strptime(text, DATE_FORMAT).date() - EPOCH).days
+    except (TypeError, ValueError):
+        return None
+
+
+def to_cents(text):
+    """Integer cents of a money string such as "3.50", or None."""
+    try:
+        cents = decimal.Decimal(text.strip()) * 100
+    except (AttributeError, decimal.InvalidOperation):
+        return None
+    if not cents.is_finite() or cents != cents.to_integral_value():
+        return None
+    return int(cents)
+
+
+def today_day():
+    return (datetime.date.today() - EPOCH).days
+
+
+def day_text(day):
+    return (EPOCH + datetime.timedelta(days=day)).strftime(DATE_FORMAT)
+
+
+def money_text(cents):
+    return str(decimal.Decimal(cents).scaleb(-2))
+
+
+def split_date(text):
+    """(day, None) if text is a valid date, else (None, text) to keep as-is."""
+    day = to_day(text) if text else None
+    return (day, None) if day is not None else (None, text)
+
+
+def split_money(text):
+    """(cents, None) if text is a valid amount, else (None, text) to keep as-is."""
+    cents = to_cents(text) if text else None
+    return (cents, None) if cents is not None else (None, text)
+
+
+# TEXT column -> typed column pairs converted by Database.migrate_step
+TYPED_COLUMNS = {
+    "books": (("late_return_fine", "fine_cents", split_money),
+              ("selling_price", "price_cents", split_money)),
+    "loans": (("date_borrowed", "borrowed_day", split_date),
+              ("date_due", "due_day", split_date),
+              ("date_overdue", "overdue_day", split_date),
+              ("late_return_fine", "fine_cents", split_money),
+              ("selling_price", "price_cents", split_money)),
+}
+
+# What a write changed. IDs are permanent, so no other row is ever affected.
+RecordChange = namedtuple("RecordChange", ["inserted", "deleted_ids"])
+
+# Result of Database.accrue_fines and one line of Database.fine_summary (money in cents)
+FineRun = namedtuple("FineRun", ["day", "loans", "total_cents", "seconds"])
+MemberFines = namedtuple("MemberFines", ["reference_no", "firstname", "surname", "loans", "days_late", "fine_cents"])
+
+
+def _fold(text):
+    """Lower-case text without diacritics, as FTS5's unicode61 tokenizer sees it."""
+    return "".join(ch for ch in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(ch))
+
+
+def record_matches_search(row, text):
+    """Client-side twin of Database.search: every word must prefix a word
+    of firstname, surname, book_title or reference_no (or text equals the
+    reference_no exactly). Case and diacritics are ignored, like FTS5."""
+    if (row["reference_no"] or "") == text:
+        return True
+    haystack = " ".join(str(row[c] or "") for c in ("firstname", "surname", "book_title", "reference_no"))
+    row_words = re.findall(r"\w+", _fold(haystack))
+    words = re.findall(r"\w+", _fold(text))
+    return bool(words) and all(any(w.startswith(q) for w in row_words) for q in words)
+
+
+class SearchCache:
+    """LRU of recent Database.search results keyed by the query text.
+
+    Each entry remembers the Database.generation it was read at, and is
+    only served while the generation is unchanged, so any write made
+    through that Database retires the whole cache. A query that extends a
+    cached one ("smi" -> "smith") is answered by filtering the cached rows
+    with record_matches_search, provided that result was not cut off at
+    SEARCH_LIMIT.
+    """
+    def __init__(self, size=SEARCH_CACHE_SIZE, max_age=SEARCH_CACHE_MAX_AGE_S):
+        self.size = size
+        self.max_age = max_age
+        self._entries = OrderedDict()  # text -> (generation, time, rows)
+
+    def get(self, text, generation):
+        """Cached rows for text, or None if the database must be asked."""
+        now = time.monotonic()
+        entry = self._entries.get(text)
+        if entry is not None and entry[0] == generation and now - entry[1] < self.max_age:
+            self._entries.move_to_end(text)
+            return entry[2]
+        for cached_text, (gen, stamp, rows) in reversed(self._entries.items()):
+            if (gen == generation and now - stamp < self.max_age and len(rows) < SEARCH_LIMIT
+                    and text.startswith(cached_text)):
+                narrowed = [row for row in rows if record_matches_search(row, text)]
+                self._entries[text] = (gen, stamp, narrowed)
+                self._trim()
+                return narrowed
+        return None
+
+    def put(self, text, rows, generation):
+        self._entries[text] = (generation, time.monotonic(), rows)
+        self._entries.move_to_end(text)
+        self._trim()
+
+    def clear(self):
+        self._entries.clear()
+
+    def _trim(self):
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+
+class GridRow:
+    """One record as a RowStore keeps it: slots instead of a dict per row,
+    with the often repeated text (names, titles, dates) interned so equal
+    values share one string. Columns that were not loaded hold None and
+    are not in keys(); rows index by column name like sqlite3.Row.
+    """
+    __slots__ = ("_loaded", *EXPORT_HEADERS)
+
+    def __init__(self, row, columns):
+        self._loaded = frozenset(columns)
+        for col in EXPORT_HEADERS:
+            setattr(self, col, _interned(col, row[col]) if col in self._loaded else None)
+
+    def __getitem__(self, col):
+        if col not in self._loaded:
+            raise KeyError(col)
+        return getattr(self, col)
+
+    def keys(self):
+        return [col for col in EXPORT_HEADERS if col in self._loaded]
+
+    @property
+    def complete(self):
+        """True once every column is loaded (a detail view needs them all)."""
+        return len(self._loaded) == len(EXPORT_HEADERS)
+
+    def merge(self, row, columns):
+        """Take the columns of a later read of the same record."""
+        for col in columns:
+            setattr(self, col, _interned(col, row[col]))
+        if not columns <= self._loaded:
+            self._loaded = self._loaded | columns
+
+    def size(self):
+        """Rough bytes held by this row alone (interned text is shared, so not counted)."""
+        return sys.getsizeof(self) + sum(
+            sys.getsizeof(getattr(self, col)) for col in self._loaded if col not in INTERNED_COLUMNS)
+
+
+def _interned(col, value):
+    return sys.intern(value) if col in INTERNED_COLUMNS and type(value) is str else value
+
+
+class RowStore:
+    """The records behind the grid, by id, within a memory budget.
+
+    Pages, search results and detail reads all go through put_many/put, so
+    a record read twice is held once and a later full read completes the
+    listed row. Rows untouched longest are evicted first once the rows'
+    estimated size passes `budget` bytes. Callers drop rows they delete or
+    change (discard) and everything after writes made elsewhere (clear).
+    """
+    def __init__(self, budget=ROW_STORE_BUDGET):
+        self.budget = budget
+        self.bytes = 0
+        self._rows = OrderedDict()  # id -> GridRow, least recently used first
+        self._sizes = {}  # id -> bytes counted for it
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, record_id):
+        return record_id in self._rows
+
+    def put(self, row):
+        """Store a sqlite3.Row/dict with an id; return its GridRow."""
+        return self.put_many([row])[0]
+
+    def put_many(self, rows):
+        """Store rows of one query (same columns); return their GridRows in order."""
+        if not rows:
+            return []
+        columns = frozenset(rows[0].keys()) & frozenset(EXPORT_HEADERS)
+        stored = []
+        for row in rows:
+            record_id = row["id"]
+            grid_row = self._rows.get(record_id)
+            if grid_row is None:
+                grid_row = self._rows[record_id] = GridRow(row, columns)
+            else:
+                self._rows.move_to_end(record_id)
+                self.bytes -= self._sizes[record_id]
+                grid_row.merge(row, columns)
+            self._sizes[record_id] = size = grid_row.size()
+            self.bytes += size
+            stored.append(grid_row)
+        self._evict()
+        return stored
+
+    def get(self, record_id):
+        """The stored GridRow for record_id, or None."""
+        grid_row = self._rows.get(record_id)
+        if grid_row is not None:
+            self._rows.move_to_end(record_id)
+        return grid_row
+
+    def discard(self, record_id):
+        if self._rows.pop(record_id, None) is not None:
+            self.bytes -= self._sizes.pop(record_id)
+
+    def clear(self):
+        self._rows.clear()
+        self._sizes.clear()
+        self.bytes = 0
+
+    def _evict(self):
+        while self.bytes > self.budget and len(self._rows) > 1:
+            record_id, _ = self._rows.popitem(last=False)
+            self.bytes -= self._sizes.pop(record_id)
+
+
+class CatalogIndex:
+    """In-memory index of the book catalog behind the book picker.
+
+    Titles are kept sorted by their casefolded form, so a prefix query is a
+    bisect plus a short walk; by_title and by_isbn give O(1) lookups.
+    """
+    def __init__(self, books):
+        self.by_title = {}
+        self.by_isbn = {}
+        keyed = []
+        for book in books:
+            if book["title"] not in self.by_title:
+                self.by_title[book["title"]] = book
+                keyed.append((book["title"].casefold(), book["title"]))
+            if book["isbn"]:
+                self.by_isbn.setdefault(book["isbn"], book)
+        keyed.sort()
+        self._keys = [key for key, _ in keyed]
+        self._titles = [title for _, title in keyed]
+
+    def __len__(self):
+        return len(self._titles)
+
+    def get(self, title_or_isbn):
+        return self.by_title.get(title_or_isbn) or self.by_isbn.get(title_or_isbn)
+
+    def match(self, text, limit=CATALOG_MATCHES):
+        """Up to limit titles for the filter text.
+
+        An exact ISBN comes first, then titles starting with the text in
+        order, then (only if there is room) titles containing it.
+        """
+        query = text.strip().casefold()
+        if not query:
+            return self._titles[:limit]
+        found = []
+        book = self.by_isbn.get(text.strip())
+        if book is not None:
+            found.append(book["title"])
+        start = bisect.bisect_left(self._keys, query)
+        for key, title in zip(itertools.islice(self._keys, start, None),
+                              itertools.islice(self._titles, start, None)):
+            if len(found) >= limit or not key.startswith(query):
+                break
+            if title not in found:
+                found.append(title)
+        if len(found) < limit:
+            for key, title in zip(self._keys, self._titles):
+                if query in key and not key.startswith(query) and title not in found:
+                    found.append(title)
+                    if len(found) >= limit:
+                        break
+        return found
+
+
+def _select_list(columns=None, alias=None):
+    """SELECT list for borrow_records columns; None selects every column."""
+    prefix = f"{alias}." if alias else ""
+    if columns is None:
+        return prefix + "*"
+    unknown = set(columns) - set(EXPORT_HEADERS)
+    if unknown:
+        raise ValueError(f"not borrow_records columns: {', '.join(sorted(unknown))}")
+    return ", ".join(prefix + col for col in columns)
+
+
+def _keyset_steps(key, values, descending=False):
+    """WHERE conditions selecting the rows after `values` in `key` order.
+
+    (a, b, id) > (x, y, z) is split into a = x AND b = y AND id > z, then
+    a = x AND b > y, then a > x: each is a single index range, and run in
+    that order they continue the sort exactly. NULL sorts first, as in
+    SQLite. Returns [(conditions, args)].
+    """
+    steps = []
+    for i in range(len(key) - 1, -1, -1):
+        conds, args = [], []
+        for col, value in zip(key[:i], values[:i]):
+            if value is None:
+                conds.append(f"{col} IS NULL")
+            else:
+                conds.append(f"{col} = ?")
+                args.append(value)
+        col, value = key[i], values[i]
+        if not descending:
+            if value is None:
+                steps.append((conds + [f"{col} IS NOT NULL"], args))
+            else:
+                steps.append((conds + [f"{col} > ?"], args + [value]))
+        elif value is not None:
+            steps.append((conds + [f"{col} < ?"], args + [value]))
+            if col in NULLABLE_SORT_COLUMNS:
+                steps.append((conds + [f"{col} IS NULL"], args))
+    return steps
+
+
+def _loan_insert_sql(keep_ids=False, skip_duplicates=False):
+    """Build the loans INSERT shared by insert_many and insert_unique.
+
+    With skip_duplicates four extra values (reference_no, book_id,
+    borrowed_day and unparsed date_borrowed) follow the loan's own and the
+    row is skipped when that loan already exists. The unary + keeps SQLite
+    from driving the check off idx_loans_borrowed, which is useless when
+    many rows share a date (or have none); the member index is selective.
+    """
+    columns = ("id", *LOAN_COLUMNS) if keep_ids else LOAN_COLUMNS
+    cols = ", ".join(columns)
+    placeholders = ", ".join("?" for _ in columns)
+    if not skip_duplicates:
+        return f"INSERT INTO loans ({cols}) VALUES ({placeholders})"
+    return f"""
+        INSERT OR IGNORE INTO loans ({cols})
+        SELECT {placeholders} WHERE NOT EXISTS (
+            SELECT 1 FROM loans l
+            JOIN members m ON m.id = l.member_ref
+            JOIN books b ON b.id = l.book_ref
+            WHERE m.reference_no = ? AND b.isbn = ?
+              AND +l.borrowed_day IS ? AND l.date_borrowed IS ?)
+    """
+
+
+class Database:
+    """SQLite wrapper for borrow records.
+
+    IDs are permanent: deleting a record never renumbers the others. The
+    sequential number shown in the UI is computed at query time (row_no).
+    Records are read through the borrow_records view and written as loans
+    pointing at members and books (see SCHEMA).
+    """
+    def __init__(self, db_path=DB_FILENAME, profile=None):
+        self.db_path = db_path
+        self.profile = profile or STORAGE_PROFILE
+        self.conn = connect(self.db_path, self.profile)
+        self.conn.row_factory = sqlite3.Row  # For easier dict-like access
+        self._member_refs = {}
+        self._book_refs = {}
+        self.generation = 0  # bumped by every committed write; see SearchCache
+        self._migrated = False  # typed columns known to be complete; see _finish_migration
+        self._create_tables()
+
+    def _create_tables(self):
+        """Create the schema, migrating an old wide borrow_records table once.
+
+        Databases created before the typed date/money columns only get the
+        columns here; their values are converted by migrate_step. Loans that
+        predate returned_day count as still out.
+        """
+        objects = dict(self.conn.execute(
+            f"SELECT name, type FROM sqlite_master WHERE name IN ('loans', 'borrow_records', "
+            f"{', '.join(repr(name) for name in SORT_INDEXES)})"))
+        legacy = objects.get("borrow_records") == "table"
+        loan_columns = {col["name"] for col in self.conn.execute("PRAGMA table_info(loans)")}
+        missing = [sqls for column, sqls in LOAN_UPGRADES if "loans" in objects and column not in loan_columns]
+        # the header-sort indexes came later than the tables
+        missing_indexes = not set(SORT_INDEXES) <= objects.keys()
+        if "loans" not in objects or legacy or missing or missing_indexes:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                upgrade = (LEGACY_PREPARE if legacy else ()) + tuple(itertools.chain.from_iterable(missing))
+                for sql in upgrade + SCHEMA:
+                    self.conn.execute(sql)
+                self._seed_catalog()
+                for sql in LEGACY_COPY if legacy else ():
+                    self.conn.execute(sql)
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+        self._create_search_index()
+
+    def _seed_catalog(self):
+        """Fill an empty books table from BOOK_MAPPING."""
+        if self.conn.execute("SELECT 1 FROM books LIMIT 1").fetchone():
+            return
+        self.conn.executemany(
+            "INSERT INTO books (isbn, title, author, fine_cents, price_cents, loan_days)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [(info["book_id"], title, info["author"], to_cents(info["late_return_fine"]),
+              to_cents(info["selling_price"]), info["days"]) for title, info in BOOK_MAPPING.items()])
+
+    @traced
+    def migrate_step(self, batch_size=MIGRATION_BATCH_SIZE):
+        """Convert the next batch of TEXT dates/money to the typed columns.
+
+        Returns True while there is more to do. Each batch is one short
+        transaction that also saves its progress, so the migration can run
+        in the background while the app is in use and resumes after a
+        restart. Values that do not parse stay in their TEXT column.
+        """
+        if self._migrated:
+            return False
+        for table, columns in TYPED_COLUMNS.items():
+            progress = self.conn.execute(
+                "SELECT last_id, done FROM schema_progress WHERE name = ?", (table,)).fetchone()
+            if progress is None or progress["done"]:
+                continue
+            texts = [text_col for text_col, _, _ in columns]
+            rows = self.conn.execute(
+                f"SELECT id, {', '.join(texts)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                (progress["last_id"], batch_size)).fetchall()
+            # books' TEXT columns are NOT NULL; an emptied loan column means "use the book's"
+            cleared = "" if table == "books" else None
+            updates = []
+            for row in rows:
+                if not any(row[col] for col in texts):
+                    continue
+                values = []
+                for text_col, _, split in columns:
+                    typed, leftover = split(row[text_col])
+                    values += [typed, leftover if leftover is not None else (row[text_col] and cleared)]
+                updates.append((*values, row["id"]))
+            assignments = ", ".join(f"{typed_col} = COALESCE(?, {typed_col}), {text_col} = ?"
+                                    for text_col, typed_col, _ in columns)
+
+            def convert(cur):
+                if not rows:
+                    cur.execute("UPDATE schema_progress SET done = 1 WHERE name = ?", (table,))
+                    return
+                cur.executemany(f"UPDATE {table} SET {assignments} WHERE id = ?", updates)
+                cur.execute("UPDATE schema_progress SET last_id = ? WHERE name = ?", (rows[-1]["id"], table))
+
+            self._write(convert)
+            return True
+        self._migrated = True
+        return False
+
+    def migrate(self):
+        """Run migrate_step until the typed-column migration is complete."""
+        while self.migrate_step():
+            pass
+
+    def _finish_migration(self):
+        """Complete the migration before a query that reads only the typed columns.
+
+        Loans not converted yet have NULL borrowed_day/due_day, so they would
+        be missed as overdue loans or duplicates, or sorted as undated. The
+        GUI converts in the background; a headless caller (CLI, server)
+        converts the rest here, once per connection.
+        """
+        if not self._migrated:
+            self.migrate()
+
+    def _create_search_index(self):
+        """Create the FTS5 index used by search() (skipped if FTS5 is missing)."""
+        existed = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'borrow_records_fts'").fetchone()
+        try:
+            self.conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search() falls back to LIKE
+            self.has_fts = False
+            return
+        self.has_fts = True
+        if not existed:
+            # index the rows that were there before the FTS table
+            self.conn.execute("INSERT INTO borrow_records_fts (borrow_records_fts) VALUES ('rebuild')")
+            self.conn.commit()
+
+    def _member_ref(self, cur, record):
+        """ID of the member described by a record dict, created if new."""
+        key = tuple(record.get(col) or "" for col in MEMBER_COLUMNS)
+        ref = self._member_refs.get(key)
+        if ref is None:
+            cols = ", ".join(MEMBER_COLUMNS)
+            marks = ", ".join("?" for _ in MEMBER_COLUMNS)
+            cur.execute(f"INSERT OR IGNORE INTO members ({cols}) VALUES ({marks})", key)
+            ref = cur.execute(f"SELECT id FROM members WHERE ({cols}) = ({marks})", key).fetchone()[0]
+            if len(self._member_refs) >= MAX_CACHED_REFS:
+                self._member_refs.clear()
+            self._member_refs[key] = ref
+        return ref
+
+    def _book_ref(self, cur, record):
+        """(id, late_return_fine, selling_price) of the record's book, created if new.
+
+        The fine and price come back as display text, as the view shows them.
+        """
+        key = tuple(record.get(col) or "" for col in ("book_id", "book_title", "author"))
+        book = self._book_refs.get(key)
+        if book is None:
+            fine_cents, fine = split_money(record.get("late_return_fine") or "")
+            price_cents, price = split_money(record.get("selling_price") or "")
+            cur.execute(
+                "INSERT OR IGNORE INTO books (isbn, title, author, fine_cents, late_return_fine,"
+                " price_cents, selling_price, loan_days) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, fine_cents, fine or "", price_cents, price or "", record.get("days_on_loan")))
+            book = tuple(cur.execute(
+                """SELECT id,
+                          CASE WHEN fine_cents IS NOT NULL THEN printf('%.2f', fine_cents / 100.0)
+                               ELSE late_return_fine END,
+                          CASE WHEN price_cents IS NOT NULL THEN printf('%.2f', price_cents / 100.0)
+                               ELSE selling_price END
+                   FROM books WHERE (isbn, title, author) = (?, ?, ?)""",
+                key).fetchone())
+            if len(self._book_refs) >= MAX_CACHED_REFS:
+                self._book_refs.clear()
+            self._book_refs[key] = book
+        return book
+
+    def _loan_values(self, cur, record):
+        """Turn a record dict (RECORD_COLUMNS keys) into a loans row, LOAN_COLUMNS order."""
+        if not record.get("created_at"):
+            record["created_at"] = datetime.datetime.now().isoformat()
+        book_ref, book_fine, book_price = self._book_ref(cur, record)
+        # only keep fine/price on the loan when they differ from the book's;
+        # blank means no override
+        fine = split_money(record.get("late_return_fine") or None)
+        price = split_money(record.get("selling_price") or None)
+        if (money_text(fine[0]) if fine[0] is not None else fine[1]) == book_fine:
+            fine = (None, None)
+        if (money_text(price[0]) if price[0] is not None else price[1]) == book_price:
+            price = (None, None)
+        return (self._member_ref(cur, record), book_ref,
+                *split_date(record.get("date_borrowed")), *split_date(record.get("date_due")),
+                record.get("days_on_loan"), *fine, *price,
+                *split_date(record.get("date_overdue")), record["created_at"])
+
+    @traced
+    def insert_record(self, record: dict):
+        """Insert a new record at the end (SQLite assigns the ID)."""
+        record_id = self.insert_many([record])[0]
+        record["id"] = record_id
+        return record_id
+
+    @traced
+    def insert_many(self, records, chunk_size=INSERT_CHUNK_SIZE):
+        """Insert an iterable of record dicts and return their new IDs.
+
+        All rows share one prepared statement (executemany) and are committed
+        once per chunk instead of once per row. Generators are consumed lazily.
+        """
+        sql = _loan_insert_sql()
+        new_ids = []
+        records = iter(records)
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+
+            def insert(cur):
+                cur.executemany(sql, [self._loan_values(cur, r) for r in chunk])
+                # rows inserted in one transaction get consecutive rowids
+                return cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+
+            last_id = self._write(insert)
+            new_ids.extend(range(last_id - len(chunk) + 1, last_id + 1))
+        return new_ids
+
+    def _write(self, work):
+        """Run work(cursor) as one transaction and commit it.
+
+        The transaction is rolled back on error and retried (see
+        with_retry) while the database is locked by another terminal.
+        """
+        def attempt():
+            cur = self.conn.cursor()
+            try:
+                result = work(cur)
+                self.conn.commit()
+                self.generation += 1
+            except sqlite3.Error:
+                self.conn.rollback()
+                # members/books created in the rolled-back transaction are gone
+                self._member_refs.clear()
+                self._book_refs.clear()
+                raise
+            return result
+        return with_retry(attempt, profile=self.profile)
+
+    def add_record(self, record: dict):
+        """Insert one record and return a RecordChange holding the stored row."""
+        record_id = self.insert_record(record)
+        row = self.conn.execute("SELECT * FROM borrow_records WHERE id = ?", (record_id,)).fetchone()
+        return RecordChange([row], [])
+
+    def remove_record(self, record_id):
+        """Delete one record and return a RecordChange naming the deleted ID."""
+        deleted = self.delete_by_id(record_id)
+        return RecordChange([], [record_id] if deleted else [])
+
+    @traced
+    def insert_unique(self, rows, keep_ids=False):
+        """Insert value tuples in one transaction, skipping duplicate loans.
+
+        rows are in RECORD_COLUMNS order, prefixed by the id when keep_ids is
+        set. A row is skipped if a record with the same reference_no, book_id
+        and date_borrowed exists (or, with keep_ids, the same id). Returns
+        the number of rows inserted.
+        """
+        self._finish_migration()
+        columns = ("id", *RECORD_COLUMNS) if keep_ids else RECORD_COLUMNS
+        sql = _loan_insert_sql(keep_ids, skip_duplicates=True)
+
+        def insert(cur):
+            params = []
+            for row in rows:
+                record = dict(zip(columns, row))
+                values = self._loan_values(cur, record)
+                if keep_ids:
+                    values = (record["id"], *values)
+                key = (record["reference_no"] or "", record["book_id"] or "",
+                       *split_date(record["date_borrowed"]))
+                params.append((*values, *key))
+            return cur.executemany(sql, params).rowcount
+
+        return self._write(insert)
+
+    def matches(self, record_id, where_clause=None, params=()):
+        """True if the record exists and satisfies where_clause (PK lookup)."""
+        sql = "SELECT 1 FROM borrow_records WHERE id = ?"
+        if where_clause:
+            sql += f" AND ({where_clause})"
+        return self.conn.execute(sql, (record_id, *params)).fetchone() is not None
+
+    @traced
+    def fetch_by_id(self, record_id):
+        """The full record with this id (every column), or None."""
+        return self.conn.execute("SELECT * FROM borrow_records WHERE id = ?", (record_id,)).fetchone()
+
+    @traced
+    def fetch_all(self, where_clause=None, params=(), columns=None):
+        """Return matching rows; each row carries its display number as row_no."""
+        sql = f"SELECT {_select_list(columns)}, ROW_NUMBER() OVER (ORDER BY id) AS row_no FROM borrow_records"
+        if where_clause:
+            sql += " WHERE " + where_clause
+        sql += " ORDER BY id ASC"
+        cur = self.conn.cursor()
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+    @traced
+    def fetch_page(self, after_id=None, before_id=None, limit=PAGE_SIZE, where_clause=None, params=(),
+                   columns=None, sort=None, descending=False):
+        """Return up to `limit` rows in id order using keyset pagination.
+
+        Pass after_id for the page following a row or before_id for the page
+        preceding it. Both walk the primary key, so a page deep in the table
+        costs the same as the first one. columns (e.g. LIST_COLUMNS) limits
+        the row to those columns; by default it has them all. sort (a
+        SORT_KEYS name) orders the pages by that column instead, through
+        its indexes; it cannot be combined with where_clause.
+        """
+        if sort is not None:
+            if where_clause:
+                raise ValueError("sorted pages cannot be filtered")
+            return self._fetch_sorted(SORT_KEYS[sort], descending, after_id, before_id, limit, columns)
+        conds, args = [], list(params)
+        if where_clause:
+            conds.append(f"({where_clause})")
+        if after_id is not None:
+            conds.append("id > ?")
+            args.append(after_id)
+        if before_id is not None:
+            conds.append("id < ?")
+            args.append(before_id)
+        sql = f"SELECT {_select_list(columns)} FROM borrow_records"
+        if conds:
+            sql += " WHERE " + " AND ".join(conds)
+        sql += " ORDER BY id DESC LIMIT ?" if before_id is not None else " ORDER BY id ASC LIMIT ?"
+        args.append(limit)
+        cur = self.conn.cursor()
+        cur.execute(sql, args)
+        rows = cur.fetchall()
+        return rows[::-1] if before_id is not None else rows
+
+    def _fetch_sorted(self, sort_key, descending, after_id, before_id, limit, columns):
+        self._finish_migration()
+        # the ids come from the indexes alone; the rows are then read by id,
+        # which keeps the view's joins out of the planner's way
+        backwards = before_id is not None
+        direction = "DESC" if descending != backwards else "ASC"
+        select = f"SELECT l.id FROM {sort_key.tables}"
+        order = f" ORDER BY {', '.join(f'{col} {direction}' for col in sort_key.key)} LIMIT ?"
+        from_id = before_id if backwards else after_id
+        if from_id is None:
+            ids = [record_id for record_id, in self.conn.execute(select + order, (limit,))]
+        else:
+            values = self.conn.execute(
+                f"""SELECT {', '.join(sort_key.key)}
+                    FROM loans l JOIN members m ON m.id = l.member_ref JOIN books b ON b.id = l.book_ref
+                    WHERE l.id = ?""", (from_id,)).fetchone()
+            ids = []
+            steps = _keyset_steps(sort_key.key, values, direction == "DESC") if values is not None else []
+            for conds, args in steps:
+                ids += [record_id for record_id, in self.conn.execute(
+                    f"{select} WHERE {' AND '.join(conds)}{order}", (*args, limit - len(ids)))]
+                if len(ids) >= limit:
+                    break
+        if not ids:
+            return []
+        if backwards:
+            ids.reverse()
+        if columns is not None and "id" not in columns:
+            columns = ("id", *columns)
+        rows = self.conn.execute(
+            f"SELECT {_select_list(columns)} FROM borrow_records WHERE id IN ({', '.join('?' * len(ids))})",
+            ids).fetchall()
+        by_id = {row["id"]: row for row in rows}
+        return [by_id[record_id] for record_id in ids if record_id in by_id]
+
+    @traced
+    def sort_ids(self, ids, sort, descending=False):
+        """ids (up to a grid's worth) in the order fetch_page(sort=...) pages them.
+
+        Same SORT_KEYS key, so ties break the same way; sorting a few
+        hundred rows in a temp b-tree is cheaper than walking the index.
+        """
+        self._finish_migration()
+        direction = "DESC" if descending else "ASC"
+        return [record_id for record_id, in self.conn.execute(
+            f"""SELECT l.id FROM loans l JOIN members m ON m.id = l.member_ref JOIN books b ON b.id = l.book_ref
+                WHERE l.id IN ({', '.join('?' * len(ids))})
+                ORDER BY {', '.join(f'{col} {direction}' for col in SORT_KEYS[sort].key)}""", list(ids))]
+
+    @traced
+    def search(self, text, limit=SEARCH_LIMIT, columns=None):
+        """Ranked search over names, book title and reference number.
+
+        An exact reference_no match (found through the members unique key,
+        which starts with reference_no, then the member's loans) comes first,
+        followed by FTS5 prefix matches on every word, best rank first.
+        Rows have `columns` (default all) plus row_no.
+        """
+        words = re.findall(r"\w+", text)
+        if not self.has_fts:
+            like_q = f"%{text}%"
+            clause = "firstname LIKE ? OR surname LIKE ? OR book_title LIKE ? OR reference_no LIKE ?"
+            return self.fetch_all(clause, (like_q, like_q, like_q, like_q), columns)
+        hits = "SELECT id, 0 AS grp, 0.0 AS score FROM borrow_records WHERE reference_no = :ref"
+        if words:
+            hits += """
+                UNION ALL
+                SELECT * FROM (
+                    SELECT rowid, 1, rank FROM borrow_records_fts
+                    WHERE borrow_records_fts MATCH :match ORDER BY rank LIMIT :limit)"""
+        sql = f"""
+            SELECT {_select_list(columns, "b")}, ROW_NUMBER() OVER (ORDER BY h.grp, h.score, b.id) AS row_no
+            FROM (SELECT id, MIN(grp) AS grp, MIN(score) AS score FROM ({hits}) GROUP BY id) h
+            JOIN borrow_records b ON b.id = h.id
+            ORDER BY row_no
+            LIMIT :limit
+        """
+        params = {
+            "ref": text,
+            "match": " ".join('"{}"*'.format(w) for w in words),
+            "limit": limit,
+        }
+        cur = self.conn.cursor()
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+    def iter_chunks(self, chunk_size=EXPORT_CHUNK_SIZE):
+        """Yield every record (EXPORT_HEADERS order) as lists of chunk_size rows."""
+        cur = self.conn.cursor()
+        cur.execute(f"SELECT {', '.join(EXPORT_HEADERS)} FROM borrow_records ORDER BY id")
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+
+    @traced
+    def fetch_books(self):
+        """Return the whole book catalog ordered by title, fine and price as display text."""
+        return self.conn.execute(
+            """SELECT id, isbn, title, author,
+                      CASE WHEN fine_cents IS NOT NULL THEN printf('%.2f', fine_cents / 100.0)
+                           ELSE late_return_fine END AS late_return_fine,
+                      CASE WHEN price_cents IS NOT NULL THEN printf('%.2f', price_cents / 100.0)
+                           ELSE selling_price END AS selling_price,
+                      loan_days
+               FROM books ORDER BY title""").fetchall()
+
+    @traced
+    def fetch_overdue(self, today=None, after=None, since=None, limit=PAGE_SIZE, columns=None):
+        """Loans still out whose due date is before `today`, most overdue first.
+
+        Each row is a borrow_records row (or its `columns`) plus due_day and
+        days_late. after=(due_day, id)
+        continues from a previous page; since=day only returns loans that
+        fell due on or after that day, i.e. the ones that became overdue
+        since the list was last refreshed. All of it is a range walk over
+        idx_loans_overdue, which holds only unreturned loans.
+        """
+        self._finish_migration()
+        today = today_day() if today is None else today
+        conds, args = ["l.returned_day IS NULL", "l.due_day < ?"], [today, today]
+        if since is not None:
+            conds.append("l.due_day >= ?")
+            args.append(since)
+        if after is not None:
+            conds.append("(l.due_day, l.id) > (?, ?)")
+            args.extend(after)
+        args.append(limit)
+        return self.conn.execute(f"""
+            SELECT {_select_list(columns, "r")}, l.due_day, ? - l.due_day AS days_late
+            FROM loans l JOIN borrow_records r ON r.id = l.id
+            WHERE {" AND ".join(conds)}
+            ORDER BY l.due_day, l.id LIMIT ?""", args).fetchall()
+
+    @traced
+    def count_overdue(self, today=None):
+        self._finish_migration()
+        today = today_day() if today is None else today
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM loans WHERE returned_day IS NULL AND due_day < ?", (today,)).fetchone()[0]
+
+    @traced
+    def mark_returned(self, record_id, day=None):
+        """Record a loan as returned on `day` (default today).
+
+        A late return also fills in date_overdue, the first day the loan was
+        overdue, unless one was already entered, and settles its accrued fine
+        at the days late on return. Returns False if the loan does not exist
+        or was already returned.
+        """
+        self._finish_migration()
+        day = today_day() if day is None else day
+        return self._write(lambda cur: cur.execute(
+            f"""UPDATE loans SET returned_day = :day,
+                   overdue_day = CASE WHEN due_day < :day AND overdue_day IS NULL
+                                           AND COALESCE(date_overdue, '') = ''
+                                      THEN due_day + 1 ELSE overdue_day END,
+                   accrued_fine_cents = CASE WHEN due_day < :day THEN (:day - due_day) * {FINE_RATE_SQL}
+                                             ELSE accrued_fine_cents END,
+                   accrued_day = CASE WHEN due_day < :day THEN :day ELSE accrued_day END
+               WHERE id = :id AND returned_day IS NULL""",
+            {"day": day, "id": record_id}).rowcount == 1)
+
+    @traced
+    def accrue_fines(self, today=None):
+        """Recompute the accrued fine of every overdue loan still out.
+
+        One set-based UPDATE over idx_loans_overdue, in a single transaction:
+        accrued_fine_cents = days late x daily rate (the loan's fine, else
+        its book's). Returns a FineRun.
+        """
+        self._finish_migration()
+        today = today_day() if today is None else today
+        started = time.perf_counter()
+        loans = self._write(lambda cur: cur.execute(
+            f"""UPDATE loans SET accrued_fine_cents = (:today - due_day) * {FINE_RATE_SQL},
+                                 accrued_day = :today
+                WHERE returned_day IS NULL AND due_day < :today""", {"today": today}).rowcount)
+        total = self.conn.execute(
+            "SELECT COALESCE(SUM(accrued_fine_cents), 0) FROM loans"
+            " WHERE returned_day IS NULL AND due_day < ?", (today,)).fetchone()[0]
+        return FineRun(today, loans, total, time.perf_counter() - started)
+
+    @traced
+    def fine_summary(self, today=None):
+        """Per-member totals of the fines accrued on their overdue loans, largest first.
+
+        The overdue loans are totalled from idx_loans_overdue before members
+        is joined, so loan history is never walked.
+        """
+        self._finish_migration()
+        today = today_day() if today is None else today
+        rows = self.conn.execute(
+            """SELECT m.reference_no, m.firstname, m.surname, f.loans, f.days_late, f.cents
+               FROM (SELECT member_ref, COUNT(*) AS loans, SUM(:today - due_day) AS days_late,
+                            COALESCE(SUM(accrued_fine_cents), 0) AS cents
+                     FROM loans INDEXED BY idx_loans_overdue
+                     WHERE returned_day IS NULL AND due_day < :today
+                     GROUP BY member_ref) f
+               JOIN members m ON m.id = f.member_ref
+               ORDER BY f.cents DESC, m.reference_no""", {"today": today})
+        return [MemberFines(*row) for row in rows]
+
+    @traced
+    def write_batch(self, ops):
+        """Apply ("insert", record) / ("delete", record_id) ops in one transaction.
+
+        Returns one result per op: the new ID of an insert (also stored in
+        record["id"]), or whether a delete found its row. If any op fails
+        the whole batch is rolled back.
+        """
+        sql = _loan_insert_sql()
+
+        def work(cur):
+            results = []
+            for op, arg in ops:
+                if op == "insert":
+                    cur.execute(sql, self._loan_values(cur, arg))
+                    arg["id"] = cur.lastrowid
+                    results.append(cur.lastrowid)
+                elif op == "delete":
+                    results.append(cur.execute("DELETE FROM loans WHERE id = ?", (arg,)).rowcount == 1)
+                else:
+                    raise ValueError(f"unknown write {op!r}")
+            return results
+        return self._write(work)
+
+    @traced
+    def delete_by_id(self, record_id):
+        """Delete a single record. Other IDs are left untouched."""
+        return self._write(
+            lambda cur: cur.execute("DELETE FROM loans WHERE id = ?", (record_id,)).rowcount)
+
+    def close(self):
+        self.conn.close()
+
+
+
+
+
+class BorrowDatabase(Database):
+    """Older name for Database, kept for scripts that still use it."""
+    def __init__(self, db_path=DB_BORROW, profile=None):
+        super().__init__(db_path, profile)
+
+
+# =========================
+# BACKGROUND JOBS
+# =========================
+class BackgroundJob(threading.Thread):
+    """Runs work(job, *args) on a worker thread.
+
+    The work function updates job.rows as it goes and should stop early
+    once job.cancelled is set. Its return value ends up in job.result and
+    any exception in job.error.
+    """
+    def __init__(self, work, *args):
+        super().__init__(daemon=True)
+        self.work = work
+        self.args = args
+        self.rows = 0
+        self.result = None
+        self.error = None
+        self._cancel = threading.Event()
+        self.started_at = time.perf_counter()
+
+    def run(self):
+        self.started_at = time.perf_counter()
+        try:
+            self.result = self.work(self, *self.args)
+        except Exception as exc:
+            self.error = exc
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def rate(self):
+        """Rows per second so far."""
+        elapsed = time.perf_counter() - self.started_at
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+
+def export_records(job, db_path, file_path, chunk_size=EXPORT_CHUNK_SIZE, profile=None):
+    """Stream every record to file_path in the Database.csv layout.
+
+    Uses its own connection so it can run on a BackgroundJob thread, and
+    holds only one fetchmany chunk in memory. Rows go to a ".part" file
+    that replaces file_path when the export completes. Returns the number
+    of rows written, or None if the job was cancelled. profile is the
+    StorageProfile to open the database with (default STORAGE_PROFILE).
+    """
+    db = Database(db_path, profile)
+    tmp_path = file_path + ".part"
+    completed = False
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_HEADERS)
+            for rows in db.iter_chunks(chunk_size):
+                if job.cancelled:
+                    break
+                writer.writerows(rows)
+                job.rows += len(rows)
+        completed = not job.cancelled
+    finally:
+        db.close()
+        if not completed and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if not completed:
+        return None
+    os.replace(tmp_path, file_path)
+    return job.rows
+
+
+class DatabaseWorker:
+    """Owns a Database on a dedicated thread and runs calls on it in order.
+
+    submit() queues fn(db, *args, **kwargs) (fn may also be the name of a
+    Database method) and returns a concurrent.futures.Future. The UI polls
+    those futures from the Tk thread, so no Tk call happens on this thread
+    and a slow query never blocks the window. opener makes the object the
+    thread owns (Database, or e.g. UserDatabase).
+    """
+    def __init__(self, db_path=DB_FILENAME, opener=None):
+        self.db_path = db_path
+        self.opener = opener or Database
+        self.db = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._current = None  # future of the call running now
+        self._thread = threading.Thread(target=self._run, name="db-worker", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self.db = self.opener(self.db_path)
+            mark_startup("records db open")
+        except Exception as exc:
+            open_error = exc
+        else:
+            open_error = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._current = future
+            try:
+                if open_error:
+                    raise open_error
+                result = fn(self.db, *args, **kwargs)
+            except BaseException as exc:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+            finally:
+                with self._lock:
+                    self._current = None
+        if self.db:
+            self.db.close()
+
+    def submit(self, fn, *args, **kwargs):
+        if isinstance(fn, str):
+            fn = getattr(self.opener, fn)
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    @property
+    def generation(self):
+        """The Database's write generation (0 until it is open)."""
+        return self.db.generation if self.db is not None else 0
+
+    def cancel(self, future):
+        """Drop a queued call, or interrupt its SQL if it is running now.
+
+        Only meant for read-only calls such as searches; an interrupted call
+        fails with sqlite3.OperationalError.
+        """
+        if future.cancel():
+            return
+        with self._lock:
+            if self._current is future and self.db is not None:
+                self.db.conn.interrupt()
+
+    def close(self, timeout=5):
+        """Finish queued calls, close the connection and stop the thread."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+# Result of import_records; errors holds the first few reject reasons
+ImportResult = namedtuple("ImportResult", ["read", "inserted", "duplicates", "rejected", "errors", "seconds"])
+MAX_IMPORT_ERRORS = 20
+
+
+def _import_values(row, keep_ids):
+    """Validate one CSV row and return its values in insert order.
+
+    Raises ValueError describing the first bad field.
+    """
+    rec = {col: (row.get(col) or "").strip() for col in RECORD_COLUMNS}
+    for col in ("date_borrowed", "date_due", "date_overdue"):
+        if rec[col]:
+            if to_day(rec[col]) is None:
+                raise ValueError(f"{col} {rec[col]!r} is not a {DATE_FORMAT} date")
+    if rec["days_on_loan"]:
+        try:
+            rec["days_on_loan"] = int(rec["days_on_loan"])
+        except ValueError:
+            raise ValueError(f"days_on_loan {rec['days_on_loan']!r} is not a whole number") from None
+    else:
+        rec["days_on_loan"] = None
+    for col in ("late_return_fine", "selling_price"):
+        if rec[col] and to_cents(rec[col]) is None:
+            raise ValueError(f"{col} {rec[col]!r} is not an amount of money")
+    if not rec["created_at"]:
+        rec["created_at"] = datetime.datetime.now().isoformat()
+    values = tuple(rec[col] for col in RECORD_COLUMNS)
+    if not keep_ids:
+        return values
+    raw_id = (row.get("id") or "").strip()
+    try:
+        return (int(raw_id) if raw_id else None, *values)
+    except ValueError:
+        raise ValueError(f"id {raw_id!r} is not a whole number") from None
+
+
+def import_records(job, db_path, file_path, keep_ids=False, chunk_size=IMPORT_CHUNK_SIZE, profile=None):
+    """Stream a Database.csv-style file into borrow_records.
+
+    Rows are validated one at a time and written chunk_size at a time, one
+    transaction per chunk. Loans already present (same reference_no,
+    book_id and date_borrowed) are skipped. With keep_ids the file's IDs are
+    kept and rows whose ID is taken are skipped too; otherwise SQLite
+    assigns new IDs. Cancelling stops after the current chunk; chunks
+    already written stay. Returns an ImportResult. profile is as for
+    export_records.
+    """
+    db = Database(db_path, profile)
+    inserted = rejected = 0
+    errors = []
+    try:
+        with open(file_path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            missing = {"reference_no", "book_id", "date_borrowed"} - set(reader.fieldnames or ())
+            if missing:
+                raise ValueError(f"CSV is missing columns: {', '.join(sorted(missing))}")
+            chunk = []
+            for row in reader:
+                job.rows += 1
+                try:
+                    chunk.append(_import_values(row, keep_ids))
+                except ValueError as exc:
+                    rejected += 1
+                    if len(errors) < MAX_IMPORT_ERRORS:
+                        errors.append(f"line {reader.line_num}: {exc}")
+                if len(chunk) >= chunk_size:
+                    inserted += db.insert_unique(chunk, keep_ids)
+                    chunk = []
+                    if job.cancelled:
+                        break
+            if chunk and not job.cancelled:
+                inserted += db.insert_unique(chunk, keep_ids)
+                chunk = []
+    finally:
+        db.close()
+    read = job.rows
+    duplicates = read - inserted - rejected - len(chunk)
+    return ImportResult(read, inserted, duplicates, rejected, errors,
+                        time.perf_counter() - job.started_at)
+
+
+# LIBRARY_TRACE_SQL=1 traces every entry point, from the first connection
+if TRACE_SQL:
+    enable_tracing()
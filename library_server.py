@@ -0,0 +1,334 @@
+"""Local JSON API over the borrow database, so many desks can share one process.
+
+    python library_server.py [--port 8765] [--db borrow_records.db] [--readers 4]
+
+    POST   /login              {"username": ..., "password": ...} -> {"token": ...}
+    GET    /records            ?after_id=&before_id=&limit=  keyset pages in id order
+    GET    /search             ?q=&limit=
+    POST   /records            record fields (borrow_records columns) -> stored record
+    DELETE /records/<id>
+
+Every request except /login needs an "Authorization: Bearer <token>" header.
+Reads are spread over a pool of reader connections. All writes go through
+one writer connection, and writes that arrive together are committed as a
+single transaction (Database.write_batch), so clients never contend for
+the SQLite file lock. Binds to 127.0.0.1 unless told otherwise.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import secrets
+import sys
+import urllib.parse
+
+from library_core import (
+    DB_FILENAME, DB_USERS, PAGE_SIZE, RECORD_COLUMNS, SEARCH_LIMIT, SQL_STATS, DatabaseWorker,
+    UserDatabase, enable_tracing, to_cents, to_day,
+)
+
+DEFAULT_PORT = 8765
+READER_COUNT = 4  # reader connections (each on its own DatabaseWorker thread)
+WRITE_BATCH_MAX = 500  # writes committed together at most
+WRITE_BATCH_WINDOW_S = 0.005  # how long the writer waits for more writes to batch
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADERS = 100
+MAX_PAGE_LIMIT = 1000  # largest limit a client may ask for
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized",
+           404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+
+def _row(row):
+    return {col: row[col] for col in ("id", *RECORD_COLUMNS)}
+
+
+def _int_param(query, name, default=None, minimum=None, maximum=None):
+    raw = query.get(name, [None])[0]
+    if raw in (None, ""):
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise HTTPError(400, f"{name} must be a whole number") from None
+    if minimum is not None and value < minimum:
+        # SQLite reads a negative LIMIT as no limit at all
+        raise HTTPError(400, f"{name} must be at least {minimum}")
+    return min(value, maximum) if maximum is not None else value
+
+
+def _record_from_json(body):
+    """Validate a POST /records body the way LibraryApp.add_record does."""
+    if not isinstance(body, dict):
+        raise HTTPError(400, "expected a JSON object")
+    unknown = set(body) - set(RECORD_COLUMNS)
+    if unknown:
+        raise HTTPError(400, f"unknown fields: {', '.join(sorted(unknown))}")
+    record = {col: body.get(col) for col in RECORD_COLUMNS}
+    for col in RECORD_COLUMNS:
+        if col != "days_on_loan" and record[col] is not None and not isinstance(record[col], str):
+            raise HTTPError(400, f"{col} must be a string")
+        if col != "days_on_loan":
+            record[col] = (record[col] or "").strip()
+    if not record["firstname"] or not record["book_title"]:
+        raise HTTPError(400, "firstname and book_title are required")
+    for col in ("date_borrowed", "date_due", "date_overdue"):
+        if record[col] and to_day(record[col]) is None:
+            raise HTTPError(400, f"{col} must be a YYYY-MM-DD date")
+    for col in ("late_return_fine", "selling_price"):
+        if record[col] and to_cents(record[col]) is None:
+            raise HTTPError(400, f"{col} must be an amount such as 3.50")
+    days = record["days_on_loan"]
+    if days is not None and (isinstance(days, bool) or not isinstance(days, int)):
+        raise HTTPError(400, "days_on_loan must be a whole number")
+    record["created_at"] = record["created_at"] or datetime.datetime.now().isoformat()
+    return record
+
+
+class LibraryServer:
+    def __init__(self, db_path=DB_FILENAME, users_path=DB_USERS, readers=READER_COUNT):
+        self.writer = DatabaseWorker(db_path)
+        self.readers = [DatabaseWorker(db_path) for _ in range(readers)]
+        self.users = DatabaseWorker(users_path, opener=UserDatabase)
+        self.sessions = {}  # token -> username
+        self._idle_readers = None
+        self._writes = None
+        self._batcher = None
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT):
+        # create the schema and finish converting old rows to the typed
+        # columns on the writer, before readers look at the file
+        await asyncio.wrap_future(self.writer.submit("migrate"))
+        self._idle_readers = asyncio.Queue()
+        for reader in self.readers:
+            self._idle_readers.put_nowait(reader)
+        self._writes = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._write_batches())
+        return await asyncio.start_server(self._serve_client, host, port)
+
+    def close(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+        for worker in (self.writer, self.users, *self.readers):
+            worker.close()
+
+    # ---------- Database access ----------
+    async def _read(self, fn, *args, **kwargs):
+        """Run fn(db, ...) on whichever reader connection is free."""
+        reader = await self._idle_readers.get()
+        try:
+            return await asyncio.wrap_future(reader.submit(fn, *args, **kwargs))
+        finally:
+            self._idle_readers.put_nowait(reader)
+
+    async def _write(self, op, arg):
+        future = asyncio.get_running_loop().create_future()
+        await self._writes.put((op, arg, future))
+        return await future
+
+    async def _write_batches(self):
+        """Collect queued writes for a few milliseconds and commit them together."""
+        while True:
+            batch = [await self._writes.get()]
+            deadline = asyncio.get_running_loop().time() + WRITE_BATCH_WINDOW_S
+            while len(batch) < WRITE_BATCH_MAX:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._writes.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            ops = [(op, arg) for op, arg, _ in batch]
+            try:
+                results = await asyncio.wrap_future(self.writer.submit("write_batch", ops))
+            except Exception:
+                # one bad write must not fail the others: retry them one by one
+                results = []
+                for op in ops:
+                    try:
+                        result, = await asyncio.wrap_future(self.writer.submit("write_batch", [op]))
+                    except Exception as exc:
+                        result = exc
+                    results.append(result)
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    # ---------- Endpoints ----------
+    async def login(self, body):
+        if not isinstance(body, dict) or not body.get("username") or not body.get("password"):
+            raise HTTPError(400, "username and password are required")
+        ok = await asyncio.wrap_future(self.users.submit(
+            "validate_user", str(body["username"]).strip(), str(body["password"]).strip()))
+        if not ok:
+            raise HTTPError(401, "invalid username or password")
+        token = secrets.token_urlsafe(24)
+        self.sessions[token] = body["username"]
+        return 200, {"token": token}
+
+    async def list_records(self, query):
+        rows = await self._read(
+            "fetch_page",
+            after_id=_int_param(query, "after_id"), before_id=_int_param(query, "before_id"),
+            limit=_int_param(query, "limit", PAGE_SIZE, 1, MAX_PAGE_LIMIT))
+        return 200, {"records": [_row(row) for row in rows]}
+
+    async def search(self, query):
+        text = query.get("q", [""])[0].strip()
+        if not text:
+            raise HTTPError(400, "q is required")
+        rows = await self._read("search", text, limit=_int_param(query, "limit", SEARCH_LIMIT, 1, SEARCH_LIMIT))
+        return 200, {"records": [_row(row) for row in rows]}
+
+    async def add_record(self, body):
+        record = _record_from_json(body)
+        await self._write("insert", record)
+        # read it back as stored: fines and prices left blank come from the book
+        row = await asyncio.wrap_future(self.writer.submit("fetch_by_id", record["id"]))
+        if row is None:
+            raise HTTPError(404, f"record {record['id']} was deleted")
+        return 201, {"record": _row(row)}
+
+    async def delete_record(self, record_id):
+        if not await self._write("delete", record_id):
+            raise HTTPError(404, f"no record {record_id}")
+        return 200, {"deleted": record_id}
+
+    async def dispatch(self, method, path, query, headers, body):
+        if path == "/login":
+            if method != "POST":
+                raise HTTPError(405, "use POST")
+            return await self.login(body)
+        auth = headers.get("authorization", "")
+        if not auth.startswith("Bearer ") or auth[len("Bearer "):] not in self.sessions:
+            raise HTTPError(401, "log in first")
+        if path == "/records":
+            if method == "GET":
+                return await self.list_records(query)
+            if method == "POST":
+                return await self.add_record(body)
+            raise HTTPError(405, "use GET or POST")
+        if path == "/search":
+            if method != "GET":
+                raise HTTPError(405, "use GET")
+            return await self.search(query)
+        if path.startswith("/records/"):
+            if method != "DELETE":
+                raise HTTPError(405, "use DELETE")
+            try:
+                record_id = int(path[len("/records/"):])
+            except ValueError:
+                raise HTTPError(404, "not found") from None
+            return await self.delete_record(record_id)
+        raise HTTPError(404, "not found")
+
+    # ---------- HTTP ----------
+    async def _serve_client(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = await self._handle(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, request_line, reader, writer):
+        keep_alive = True
+        try:
+            try:
+                method, target, version = request_line.decode("latin-1").split()
+            except ValueError:
+                raise HTTPError(400, "malformed request line") from None
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                if len(headers) >= MAX_HEADERS:
+                    raise HTTPError(400, "too many headers")
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+            try:
+                length = int(headers.get("content-length") or 0)
+            except ValueError:
+                raise HTTPError(400, "bad Content-Length") from None
+            if length > MAX_BODY_BYTES:
+                keep_alive = False
+                raise HTTPError(413, "request body too large")
+            body = None
+            if length:
+                try:
+                    body = json.loads(await reader.readexactly(length))
+                except ValueError:
+                    raise HTTPError(400, "body is not valid JSON") from None
+            url = urllib.parse.urlsplit(target)
+            status, payload = await self.dispatch(
+                method.upper(), url.path, urllib.parse.parse_qs(url.query), headers, body)
+        except HTTPError as exc:
+            status, payload = exc.status, {"error": str(exc)}
+        except Exception as exc:
+            status, payload = 500, {"error": str(exc)}
+        data = json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data)
+        return keep_alive
+
+
+async def serve(args):
+    server = LibraryServer(args.db, args.users, args.readers)
+    listener = await server.start(args.host, args.port)
+    port = listener.sockets[0].getsockname()[1]
+    print(f"Serving {args.db} on http://{args.host}:{port}", file=sys.stderr, flush=True)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local JSON API over the library borrow database.")
+    parser.add_argument("--db", default=DB_FILENAME)
+    parser.add_argument("--users", default=DB_USERS, help="users database for /login")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="0 picks a free port")
+    parser.add_argument("--readers", type=int, default=READER_COUNT)
+    parser.add_argument("--trace-sql", action="store_true",
+                        help="log slow statements and print method timings on shutdown")
+    args = parser.parse_args(argv)
+    if args.trace_sql:
+        enable_tracing()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    if SQL_STATS.enabled:
+        SQL_STATS.report()
+
+
+if __name__ == "__main__":
+    main()
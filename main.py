@@ -1,127 +1,18 @@
+# library_core comes first so the startup timing it starts also covers Tk
+from library_core import (
+    DATE_FORMAT, LIST_COLUMNS, PAGE_SIZE, SQL_STATS, BackgroundJob, CatalogIndex, DatabaseWorker,
+    RecordChange, RowStore, SearchCache, UserDatabase, day_text, enable_startup_timing, enable_tracing,
+    export_records, finish_startup, import_records, mark_startup, money_text, record_matches_search, to_cents,
+    to_day, today_day,
+)
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import sqlite3
-import hashlib
 import datetime
-import csv
+import itertools
 import os
-
-# =========================
-# CONFIG & DATA
-# =========================
-DATE_FORMAT = "%Y-%m-%d"
-DB_USERS = "users.db"
-DB_BORROW = "borrow_records.db"
-
-
-# =========================
-# USER DATABASE
-# =========================
-class UserDatabase:
-    def __init__(self, db_path=DB_USERS):
-        self.conn = sqlite3.connect(db_path)
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE,
-                password TEXT
-            )
-        """)
-        self.conn.commit()
-
-    def hash_password(self, password):
-        return hashlib.sha256(password.encode()).hexdigest()
-
-    def add_user(self, username, password):
-        try:
-            self.conn.execute("INSERT INTO users (username, password) VALUES (?, ?)",
-                              (username, self.hash_password(password)))
-            self.conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
-
-    def validate_user(self, username, password):
-        cur = self.conn.cursor()
-        cur.execute("SELECT * FROM users WHERE username=? AND password=?",
-                    (username, self.hash_password(password)))
-        return cur.fetchone() is not None
-
-    def close(self):
-        self.conn.close()
-
-# =========================
-# BORROW DATABASE
-# =========================
-class BorrowDatabase:
-    def __init__(self, db_path=DB_BORROW):
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row
-        self._create_table()
-
-    def _create_table(self):
-        self.conn.execute("""
-        CREATE TABLE IF NOT EXISTS borrow_records (
-            id INTEGER PRIMARY KEY,
-            member_type TEXT,
-            reference_no TEXT,
-            title TEXT,
-            firstname TEXT,
-            surname TEXT,
-            mobile TEXT,
-            address1 TEXT,
-            address2 TEXT,
-            postcode TEXT,
-            book_id TEXT,
-            book_title TEXT,
-            author TEXT,
-            date_borrowed TEXT,
-            date_due TEXT,
-            days_on_loan INTEGER,
-            late_return_fine TEXT,
-            selling_price TEXT,
-            date_overdue TEXT,
-            created_at TEXT
-        )
-        """)
-        self.conn.commit()
-
-    def _get_next_id(self):
-        cur = self.conn.cursor()
-        cur.execute("SELECT MAX(id) FROM borrow_records")
-        max_id = cur.fetchone()[0]
-        return 1 if max_id is None else max_id + 1
-
-    def insert_record(self, record: dict):
-        record_id = self._get_next_id()
-        record["id"] = record_id
-        record.setdefault("created_at", datetime.datetime.now().isoformat())
-        cols = ", ".join(record.keys())
-        placeholders = ", ".join("?" for _ in record)
-        values = tuple(record.values())
-        cur = self.conn.cursor()
-        cur.execute(f"INSERT INTO borrow_records ({cols}) VALUES ({placeholders})", values)
-        self.conn.commit()
-        return record_id
-
-    def fetch_all(self, where_clause=None, params=()):
-        sql = "SELECT * FROM borrow_records"
-        if where_clause:
-            sql += " WHERE " + where_clause
-        sql += " ORDER BY id ASC"
-        cur = self.conn.cursor()
-        cur.execute(sql, params)
-        return cur.fetchall()
-
-    def delete_by_id(self, record_id):
-        cur = self.conn.cursor()
-        cur.execute("DELETE FROM borrow_records WHERE id = ?", (record_id,))
-        cur.execute("UPDATE borrow_records SET id = id - 1 WHERE id > ?", (record_id,))
-        self.conn.commit()
-        return cur.rowcount
-
-    def close(self):
-        self.conn.close()
+import sys
+import time
+from collections import namedtuple
 
 # =========================
 # LOGIN FRAME
@@ -129,7 +20,7 @@ class BorrowDatabase:
 class LoginFrame(ttk.Frame):
     def __init__(self, parent, on_success):
         super().__init__(parent)
-        self.db = UserDatabase()
+        self._db = None  # opened on first use so the form shows without waiting on disk
         self.on_success = on_success
         self.username = tk.StringVar()
         self.password = tk.StringVar()
@@ -142,6 +33,13 @@ class LoginFrame(ttk.Frame):
         ttk.Button(self, text="Login", command=self.login).grid(row=2, column=0, pady=15)
         ttk.Button(self, text="Sign Up", command=self.signup).grid(row=2, column=1, pady=15)
 
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = UserDatabase()
+            mark_startup("users db open")
+        return self._db
+
     def login(self):
         user = self.username.get().strip()
         pwd = self.password.get().strip()
@@ -149,6 +47,7 @@ class LoginFrame(ttk.Frame):
             messagebox.showwarning("Input Error", "Enter username and password")
             return
         if self.db.validate_user(user, pwd):
+            mark_startup("login ok")
             self.db.close()
             self.destroy()
             self.on_success()
@@ -166,185 +65,108 @@ class LoginFrame(ttk.Frame):
         else:
             messagebox.showerror("Error", "Username already exists.")
 
-import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
-import sqlite3
-import datetime
-import csv
-import os
-
-# =========================
-# CONFIG & BOOK DATA (TOP)
-# =========================
-DB_FILENAME = "library_records.db"
-DATE_FORMAT = "%Y-%m-%d"
-
-# Keep the first three original sample books and then the African literature list
-BOOK_LIST = [
-    "Cinderella",
-    "Game Design",
-    "Ancient Rome",
-
-    "Sundown at Dawn: A Liberian Odyssey",
-    "The Rain and the Night",
-    "Why Nobody Knows When He Will Die",
-    "Things Fall Apart",
-    "Arrow of God",
-    "Nervous Conditions",
-    "So Long a Letter",
-    "The Beautyful Ones Are Not Yet Born",
-    "Season of Migration to the North",
-    "Petals of Blood",
-    "Weep Not, Child",
-    "The Palm-Wine Drinkard",
-    "Purple Hibiscus",
-    "The Joys of Motherhood"
-]
-
-# Mapping used to autofill Book ID, Author, Fine & Price
-BOOK_MAPPING = {
-    "Cinderella": {"book_id": "ISBN-101", "author": "Paul Parker", "late_return_fine": "2.99", "selling_price": "9.95", "days": 14},
-    
-    "Game Design": {"book_id": "ISBN-102", "author": "James Ford", "late_return_fine": "3.50", "selling_price": "12.95", "days": 12},
-    
-    "Ancient Rome": {"book_id": "ISBN-103", "author": "Julia White", "late_return_fine": "2.30", "selling_price": "10.99", "days": 10},
-
-    "Sundown at Dawn: A Liberian Odyssey": {"book_id": "ISBN-104", "author": "Wilton G. S. Sankawulo", "late_return_fine": "3.00", "selling_price": "15.00", "days": 14},
-    
-    "The Rain and the Night": {"book_id": "ISBN-105", "author": "Wilton G. S. Sankawulo", "late_return_fine": "3.00", "selling_price": "14.00", "days": 14},
-    
-    "Why Nobody Knows When He Will Die and Other Stories": {"book_id": "ISBN-106", "author": "Wilton G. S. Sankawulo", "late_return_fine": "2.00", "selling_price": "14.00", "days": 14},
-    
-    "Things Fall Apart": {"book_id": "ISBN-107", "author": "Chinua Achebe", "late_return_fine": "3.50", "selling_price": "18.00", "days": 14},
-    
-    "Arrow of God": {"book_id": "ISBN-108", "author": "Chinua Achebe", "late_return_fine": "3.50", "selling_price": "17.00", "days": 14},
-    
-    "Nervous Conditions": {"book_id": "ISBN-109", "author": "Tsitsi Dangarembga", "late_return_fine": "3.00", "selling_price": "16.50", "days": 14},
-    
-    "So Long a Letter": {"book_id": "ISBN-1010", "author": "Mariama Bâ", "late_return_fine": "2.50", "selling_price": "14.50", "days": 14},
-    
-    "The Beautyful Ones Are Not Yet Born": {"book_id": "ISBN-1011", "author": "Ayi Kwei Armah", "late_return_fine": "3.50", "selling_price": "18.50", "days": 14},
-    
-    "Season of Migration to the North": {"book_id": "ISBN-1012", "author": "Tayeb Salih", "late_return_fine": "3.50", "selling_price": "19.00", "days": 14},
-    
-    "Petals of Blood": {"book_id": "ISBN-1013", "author": "Ngũgĩ wa Thiong’o", "late_return_fine": "4.00", "selling_price": "20.00", "days": 14},
-    
-    "Weep Not, Child": {"book_id": "ISBN-1014", "author": "Ngũgĩ wa Thiong’o", "late_return_fine": "3.50", "selling_price": "17.50", "days": 14},
-    
-    "The Palm-Wine Drinkard": {"book_id": "ISBN-1015", "author": "Amos Tutuola", "late_return_fine": "2.50", "selling_price": "13.50", "days": 14},
-    
-    "Purple Hibiscus": {"book_id": "ISBN-1016", "author": "Chimamanda Ngozi Adichie", "late_return_fine": "3.50", "selling_price": "19.00", "days": 14},
-    
-    "The Joys of Motherhood": {"book_id": "ISBN-1017", "author": "Buchi Emecheta", "late_return_fine": "3.00", "selling_price": "16.00", "days": 14}
-}
 
 # =========================
-# DATABASE LAYER (SEPARATE)
+# APPLICATION UI & LOGIC
 # =========================
-import sqlite3
-import datetime
+MAX_TREE_ROWS = 1000  # rows kept in the Treeview while paging
+JOB_POLL_MS = 200  # how often a ProgressDialog refreshes
+MIGRATE_PAUSE_MS = 50  # idle gap between typed-column migration batches
+OVERDUE_CHECK_MS = 60000  # how often the Overdue view checks whether the date changed
+FINE_SUMMARY_LINES = 10  # members listed after a fine run
+SEARCH_DEBOUNCE_MS = 250  # typing pause before a live search runs
+CATALOG_FILTER_MS = 100  # typing pause before the book picker refilters
+DB_POLL_MS = 15  # how often LibraryApp checks for finished database calls
+TIMING_REFRESH_MS = 1000  # how often the status bar timings refresh (with --trace-sql)
+TIMING_STATUS_METHODS = 3  # busiest methods shown in the status bar
+# Treeview columns whose heading sorts the grid, and the SORT_KEYS order they use
+SORTABLE_HEADINGS = {"name": "name", "book_title": "book_title", "author": "author",
+                     "borrowed": "date_borrowed", "due": "date_due"}
+
+
+class ProgressDialog(tk.Toplevel):
+    """Shows a BackgroundJob's progress and throughput, with a Cancel button.
+
+    Starts the job, then calls on_done(job) on the Tk thread when it ends.
+    """
+    def __init__(self, parent, title, job, on_done):
+        super().__init__(parent)
+        self.title(title)
+        self.resizable(False, False)
+        self.transient(parent)
+        self.job = job
+        self.on_done = on_done
+        self.status = tk.StringVar(value="Starting...")
+        ttk.Label(self, textvariable=self.status, width=42).pack(padx=16, pady=(16, 8))
+        self.cancel_btn = ttk.Button(self, text="Cancel", command=self._cancel)
+        self.cancel_btn.pack(pady=(0, 16))
+        self.protocol("WM_DELETE_WINDOW", self._cancel)
+        job.start()
+        self.after(JOB_POLL_MS, self._poll)
+
+    def _cancel(self):
+        self.job.cancel()
+        self.cancel_btn.state(["disabled"])
+        self.status.set("Cancelling...")
+
+    def _poll(self):
+        if not self.job.cancelled:
+            self.status.set(f"{self.job.rows:,} rows  ({self.job.rate():,.0f} rows/s)")
+        if self.job.is_alive():
+            self.after(JOB_POLL_MS, self._poll)
+            return
+        self.destroy()
+        self.on_done(self.job)
 
-DB_FILENAME = "borrow_records.db"
-
-class Database:
-    """SQLite wrapper for borrow records with sequential IDs that shift on deletion."""
-    def __init__(self, db_path=DB_FILENAME):
-        self.db_path = db_path
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row  # For easier dict-like access
-        self._create_tables()
-
-    def _create_tables(self):
-        sql = """
-        CREATE TABLE IF NOT EXISTS borrow_records (
-            id INTEGER PRIMARY KEY,
-            member_type TEXT,
-            reference_no TEXT,
-            title TEXT,
-            firstname TEXT,
-            surname TEXT,
-            mobile TEXT,
-            address1 TEXT,
-            address2 TEXT,
-            postcode TEXT,
-            book_id TEXT,
-            book_title TEXT,
-            author TEXT,
-            date_borrowed TEXT,
-            date_due TEXT,
-            days_on_loan INTEGER,
-            late_return_fine TEXT,
-            selling_price TEXT,
-            date_overdue TEXT,
-            created_at TEXT
-        );
-        """
-        self.conn.execute(sql)
-        self.conn.commit()
-
-    def _get_next_id(self):
-        """Return the next ID (always max ID + 1)."""
-        cur = self.conn.cursor()
-        cur.execute("SELECT MAX(id) FROM borrow_records")
-        max_id = cur.fetchone()[0]
-        return 1 if max_id is None else max_id + 1
-
-    def insert_record(self, record: dict):
-        """Insert a new record at the end (highest ID)."""
-        record_id = self._get_next_id()
-        record["id"] = record_id
-        if "created_at" not in record:
-            record["created_at"] = datetime.datetime.now().isoformat()
-
-        cols = ", ".join(record.keys())
-        placeholders = ", ".join("?" for _ in record)
-        values = tuple(record.values())
-        cur = self.conn.cursor()
-        cur.execute(f"INSERT INTO borrow_records ({cols}) VALUES ({placeholders})", values)
-        self.conn.commit()
-        return record_id
-
-    def fetch_all(self, where_clause=None, params=()):
-        sql = "SELECT * FROM borrow_records"
-        if where_clause:
-            sql += " WHERE " + where_clause
-        sql += " ORDER BY id ASC"
-        cur = self.conn.cursor()
-        cur.execute(sql, params)
-        return cur.fetchall()
-
-    def delete_by_id(self, record_id):
-        """Delete a record and shift all higher IDs down by 1 to maintain sequence."""
-        cur = self.conn.cursor()
-
-        # Delete the record
-        cur.execute("DELETE FROM borrow_records WHERE id = ?", (record_id,))
-
-        # Shift IDs down for all higher IDs
-        cur.execute("""
-            UPDATE borrow_records
-            SET id = id - 1
-            WHERE id > ?
-        """, (record_id,))
-        self.conn.commit()
-        return cur.rowcount
-
-    def close(self):
-        self.conn.close()
 
+# What the dashboard shows first, queued on its worker while the login form is up
+Prefetch = namedtuple("Prefetch", ["page", "catalog", "started_at"])
+PREFETCH_MAX_AGE_S = 120  # an older prefetched page is fetched again
 
 
+def prefetch_dashboard(worker):
+    """Start loading the first record page and the book catalog on worker."""
+    return Prefetch(worker.submit("fetch_page", columns=LIST_COLUMNS),
+                    worker.submit(lambda db: CatalogIndex(db.fetch_books())),
+                    time.monotonic())
 
 
-# =========================
-# APPLICATION UI & LOGIC
-# =========================
 class LibraryApp:
-    def __init__(self, root):
+    def __init__(self, root, worker=None, prefetch=None):
         self.root = root
         self.root.title("Library Management System")
         self.root.geometry("1150x700")
-        self.db = Database()
+        self.worker = worker or DatabaseWorker()
+
+        # database calls in flight: [future, callback, channel, token]; a
+        # result is dropped if a newer call was made on the same channel
+        self._pending = []
+        self._polling = False
+        self._latest = {}
+        self._tokens = itertools.count()
+        self.status_var = tk.StringVar()
+
+        # keyset paging state for the record grid (None while showing search results)
+        self._filter = None
+        self._search_text = ""
+        self._first_no = 1
+        self._at_start = True
+        self._at_end = True
+        self._page_pending = False
+        self._view_id = 0  # bumped whenever the grid is reloaded or searched
+        self._sort = {}  # fetch_page sort arguments for the paged grid
+        self._sort_heading = None  # (tree column, descending) the rows are shown sorted by
+        self._overdue_day = None  # day the Overdue view was computed for, None in other views
+        self._overdue_total = 0
+        self.view_var = tk.StringVar()
+        self.timing_var = tk.StringVar()
+        self._catalog = CatalogIndex([])
+        self._catalog_after = None  # pending book picker refilter
+        self.book_filter = tk.StringVar()
+        self._search_cache = SearchCache()
+        self._rows = RowStore()  # records shown or recently shown, for detail lookups
+        self._search_after = None  # pending debounced search
+        self._search_future = None  # search running on the worker
 
         # variables
         self.member_type = tk.StringVar()
@@ -367,11 +189,31 @@ class LibraryApp:
         self.date_due = tk.StringVar()
         self.date_overdue = tk.StringVar()
 
+        # queue the first page now so the worker opens the database and runs
+        # the query while the widgets are built; it fills the grid once the
+        # shell has drawn. Catalog and migration work queue up behind it.
+        if prefetch is not None and time.monotonic() - prefetch.started_at < PREFETCH_MAX_AGE_S:
+            self._view_id += 1
+            self._track(prefetch.page, channel="records",
+                        callback=lambda rows: self._show_first_page(rows, None, ()))
+        else:
+            self._load_records()
+        if prefetch is not None:
+            self._track(prefetch.catalog, callback=self._show_catalog)
+        else:
+            self._db_call(lambda db: CatalogIndex(db.fetch_books()), callback=self._show_catalog)
+
         self._build_title()
         self._build_form()
         self._build_buttons()
+        self._build_status_bar()
         self._build_treeview()
-        self._load_records()
+        mark_startup("dashboard built")
+        self.root.after_idle(lambda: mark_startup("dashboard painted"))
+        self._migrate_step()
+        self.root.after(OVERDUE_CHECK_MS, self._check_overdue_day)
+        if SQL_STATS.enabled:
+            self._show_timings()
 
         # ensure borrowed/due dates when user focuses window
         self.root.bind("<FocusIn>", lambda e: self._ensure_dates())
@@ -452,9 +294,10 @@ class LibraryApp:
         book_frame = ttk.Frame(self.root, padding=6)
         book_frame.place(relx=0.78, rely=0.15)
         ttk.Label(book_frame, text="Books (click to auto-fill)").pack(anchor="w")
+        filter_entry = ttk.Entry(book_frame, textvariable=self.book_filter, width=38)
+        filter_entry.pack(anchor="w", pady=(0, 4))
+        self.book_filter.trace_add("write", self._on_book_filter_typed)
         self.book_listbox = tk.Listbox(book_frame, height=14, width=36)
-        for b in BOOK_LIST:
-            self.book_listbox.insert(tk.END, b)
         self.book_listbox.pack()
         self.book_listbox.bind("<<ListboxSelect>>", self.on_book_selected)
 
@@ -467,14 +310,35 @@ class LibraryApp:
         ttk.Button(btn_frm, text="Reset Fields", style="Blue.TButton", command=self.reset_fields).grid(row=0, column=2, padx=6)
         ttk.Button(btn_frm, text="Refresh / Load", style="Blue.TButton", command=self._load_records).grid(row=0, column=3, padx=6)
         ttk.Button(btn_frm, text="Export CSV", style="Blue.TButton", command=self.export_csv).grid(row=0, column=4, padx=6)
-        ttk.Button(btn_frm, text="Exit", style="Blue.TButton", command=self._on_exit).grid(row=0, column=5, padx=6)
+        ttk.Button(btn_frm, text="Import CSV", style="Blue.TButton", command=self.import_csv).grid(row=0, column=5, padx=6)
+        ttk.Button(btn_frm, text="Exit", style="Blue.TButton", command=self._on_exit).grid(row=0, column=6, padx=6)
 
         ttk.Label(btn_frm, text="Search:").grid(row=1, column=0, pady=8, sticky="e")
         self.search_var = tk.StringVar()
         search_entry = ttk.Entry(btn_frm, textvariable=self.search_var, width=40)
         search_entry.grid(row=1, column=1, columnspan=3, sticky="w")
+        search_entry.bind("<Return>", lambda e: self.search_records())
+        self.search_var.trace_add("write", self._on_search_typed)
         ttk.Button(btn_frm, text="Go", style="Blue.TButton", command=self.search_records).grid(row=1, column=4, sticky="w", padx=6)
-
+        ttk.Button(btn_frm, text="Overdue", style="Blue.TButton", command=self.show_overdue).grid(row=1, column=5, padx=6)
+        ttk.Button(btn_frm, text="Mark Returned", style="Blue.TButton", command=self.mark_returned).grid(row=1, column=6, padx=6)
+        ttk.Button(btn_frm, text="Accrue Fines", style="Blue.TButton", command=self.accrue_fines).grid(row=1, column=7, padx=6)
+
+
+    def _build_status_bar(self):
+        bar = ttk.Frame(self.root, padding=(12, 2))
+        bar.pack(side="bottom", fill="x")
+        ttk.Label(bar, textvariable=self.status_var, foreground="gray").pack(side="left")
+        ttk.Label(bar, textvariable=self.view_var, foreground="gray").pack(side="right")
+        if SQL_STATS.enabled:
+            ttk.Label(bar, textvariable=self.timing_var, foreground="gray").pack(side="left", padx=24)
+
+    def _show_timings(self):
+        """Refresh the p50/p99 latencies of the busiest database methods."""
+        parts = [f"{t.name.rpartition('.')[2]} p50 {t.p50 * 1000:.1f} / p99 {t.p99 * 1000:.1f} ms"
+                 for t in SQL_STATS.timings()[:TIMING_STATUS_METHODS]]
+        self.timing_var.set("   ".join(parts))
+        self.root.after(TIMING_REFRESH_MS, self._show_timings)
 
     def _build_treeview(self):
         frame = ttk.Frame(self.root, padding=8)
@@ -482,8 +346,8 @@ class LibraryApp:
 
         columns = ("id", "member", "ref", "name", "mobile", "book_title", "author", "borrowed", "due", "days")
         self.tree = ttk.Treeview(frame, columns=columns, show="headings", selectmode="browse")
-        headings = {
-            "id": "ID",
+        self._headings = headings = {
+            "id": "No.",
             "member": "Member Type",
             "ref": "Ref No",
             "name": "Name",
@@ -496,13 +360,16 @@ class LibraryApp:
         }
         for col in columns:
             self.tree.heading(col, text=headings[col])
+            if col in SORTABLE_HEADINGS:
+                self.tree.heading(col, command=lambda col=col: self.sort_by(col))
             widths = {"id": 40, "member": 100, "ref": 90, "name": 140, "mobile": 100,
                       "book_title": 160, "author": 120, "borrowed": 100, "due": 100, "days": 60}
             self.tree.column(col, width=widths[col], anchor="w")
 
         vsb = ttk.Scrollbar(frame, orient="vertical", command=self.tree.yview)
         hsb = ttk.Scrollbar(frame, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscroll=vsb.set, xscroll=hsb.set)
+        self._vsb = vsb
+        self.tree.configure(yscroll=self._on_tree_scroll, xscroll=hsb.set)
         self.tree.grid(row=0, column=0, sticky="nsew")
         vsb.grid(row=0, column=1, sticky="ns")
         hsb.grid(row=1, column=0, sticky="ew")
@@ -511,6 +378,51 @@ class LibraryApp:
 
         self.tree.bind("<Double-1>", self._on_tree_double_click)
 
+    # ---------- Database calls ----------
+    def _db_call(self, fn, *args, callback=None, channel=None, **kwargs):
+        """Run a Database call on the worker; callback(result) runs on the Tk thread.
+
+        With a channel, only the newest call's result is delivered: an
+        older search finishing after a newer one is silently dropped.
+        """
+        return self._track(self.worker.submit(fn, *args, **kwargs), callback, channel)
+
+    def _track(self, future, callback=None, channel=None):
+        """Deliver an already submitted call's result the way _db_call does."""
+        token = next(self._tokens)
+        if channel:
+            self._latest[channel] = token
+        if not self._polling:
+            self._polling = True
+            self.root.after(DB_POLL_MS, self._poll_db)
+        self._pending.append((future, callback, channel, token))
+        self._set_busy(True)
+        return future
+
+    def _poll_db(self):
+        still_pending = []
+        done = []
+        for entry in self._pending:
+            (done if entry[0].done() else still_pending).append(entry)
+        self._pending = still_pending
+        for future, callback, channel, token in done:
+            if future.cancelled() or (channel and self._latest.get(channel) != token):
+                continue  # stale
+            exc = future.exception()
+            if exc is not None:
+                messagebox.showerror("Database Error", str(exc))
+            elif callback:
+                callback(future.result())
+        if self._pending:
+            self.root.after(DB_POLL_MS, self._poll_db)
+        else:
+            self._polling = False
+            self._set_busy(False)
+
+    def _set_busy(self, busy):
+        self.status_var.set("Working..." if busy else "")
+        self.root.config(cursor="watch" if busy else "")
+
     # ---------- Utility actions ----------
     def _ensure_dates(self):
         if not self.date_borrowed.get():
@@ -524,19 +436,34 @@ class LibraryApp:
             due = datetime.date.today() + datetime.timedelta(days=days)
             self.date_due.set(due.strftime(DATE_FORMAT))
 
+    def _show_catalog(self, catalog):
+        self._catalog = catalog
+        self._filter_catalog()
+
+    def _on_book_filter_typed(self, *_):
+        if self._catalog_after is not None:
+            self.root.after_cancel(self._catalog_after)
+        self._catalog_after = self.root.after(CATALOG_FILTER_MS, self._filter_catalog)
+
+    def _filter_catalog(self):
+        """Show the top CATALOG_MATCHES titles for the filter box (title prefix, substring or ISBN)."""
+        self._catalog_after = None
+        self.book_listbox.delete(0, tk.END)
+        self.book_listbox.insert(tk.END, *self._catalog.match(self.book_filter.get()))
+
     def on_book_selected(self, event):
         sel = self.book_listbox.curselection()
         if not sel:
             return
         book = self.book_listbox.get(sel[0])
         self.book_title.set(book)
-        info = BOOK_MAPPING.get(book)
+        info = self._catalog.by_title.get(book)
         if info:
-            self.book_id.set(info.get("book_id", ""))
-            self.author.set(info.get("author", ""))
-            self.late_return_fine.set(info.get("late_return_fine", ""))
-            self.selling_price.set(info.get("selling_price", ""))
-            self.days_on_loan.set(info.get("days", 14))
+            self.book_id.set(info["isbn"])
+            self.author.set(info["author"])
+            self.late_return_fine.set(info["late_return_fine"])
+            self.selling_price.set(info["selling_price"])
+            self.days_on_loan.set(info["loan_days"] or 14)
         self._ensure_dates()
 
     def add_record(self):
@@ -544,6 +471,15 @@ class LibraryApp:
         if not self.book_title.get().strip() or not self.firstname.get().strip():
             messagebox.showwarning("Validation", "Please enter at least a firstname and book title.")
             return
+        for label, var in (("Date Borrowed", self.date_borrowed), ("Date Due", self.date_due),
+                           ("Date Overdue", self.date_overdue)):
+            if var.get().strip() and to_day(var.get().strip()) is None:
+                messagebox.showwarning("Validation", f"{label} must be a {DATE_FORMAT} date.")
+                return
+        for label, var in (("Late Return Fine", self.late_return_fine), ("Selling Price", self.selling_price)):
+            if var.get().strip() and to_cents(var.get().strip()) is None:
+                messagebox.showwarning("Validation", f"{label} must be an amount such as 3.50.")
+                return
 
         rec = {
             "member_type": self.member_type.get().strip(),
@@ -566,10 +502,30 @@ class LibraryApp:
             "date_overdue": self.date_overdue.get().strip(),
             "created_at": datetime.datetime.now().isoformat()
         }
-        new_id = self.db.insert_record(rec)
-        messagebox.showinfo("Saved", f"Record saved (ID {new_id}).")
+        view_filter = self._filter
+
+        def add(db):
+            change = db.add_record(rec)
+            # the grid may only hold part of the table, so ask the database
+            # whether the new row passes the current filter
+            in_view = view_filter is not None and db.matches(rec["id"], *view_filter)
+            return change, view_filter, in_view
+
+        self._db_call(add, callback=self._on_record_added)
+
+    def _on_record_added(self, result):
+        change, view_filter, in_view = result
+        self._rows.put_many(change.inserted)
+        messagebox.showinfo("Saved", f"Record saved (ID {change.inserted[0]['id']}).")
         self.reset_fields()
-        self._load_records()
+        if view_filter is self._filter:
+            self._apply_change(change, in_view)
+
+    def _migrate_step(self, more=True):
+        """Convert old TEXT dates/money a batch at a time between other work."""
+        if more:
+            self.root.after(MIGRATE_PAUSE_MS, lambda: self._db_call(
+                "migrate_step", channel="migrate", callback=self._migrate_step))
 
     def reset_fields(self):
         for var in [self.member_type, self.reference, self.title, self.firstname, self.surname,
@@ -580,21 +536,359 @@ class LibraryApp:
         self.days_on_loan.set(14)
 
     def _load_records(self, where_clause=None, params=()):
-        for r in self.tree.get_children():
-            self.tree.delete(r)
-        rows = self.db.fetch_all(where_clause, params)
-        for row in rows:
-            rec_id = row[0]
-            member = row[1]
-            ref = row[2]
-            name = f"{row[4]} {row[5]}"
-            mobile = row[6]
-            book_title = row[11]
-            author = row[12]
-            borrowed = row[13]
-            due = row[14]
-            days = row[15]
-            self.tree.insert("", "end", iid=str(rec_id), values=(rec_id, member, ref, name, mobile, book_title, author, borrowed, due, days))
+        """Show the first page of records; later pages load as the user scrolls."""
+        self._view_id += 1
+        self._db_call("fetch_page", where_clause=where_clause, params=params, columns=LIST_COLUMNS,
+                      **self._sort, channel="records", callback=lambda rows: self._show_first_page(rows, where_clause, params))
+
+    def _show_first_page(self, rows, where_clause, params):
+        self._clear_tree()
+        self._set_overdue_day(None)
+        self._filter = (where_clause, params)
+        sort = self._sort.get("sort")
+        self._set_sort_heading(
+            next((col for col, key in SORTABLE_HEADINGS.items() if key == sort), None),
+            self._sort.get("descending", False))
+        self._first_no = 1
+        self._at_start = True
+        self._at_end = len(rows) < PAGE_SIZE
+        self._page_pending = False
+        for n, row in enumerate(self._rows.put_many(rows), start=1):
+            self.tree.insert("", "end", iid=str(row["id"]), values=self._row_values(row, n))
+        finish_startup("first page shown")
+
+    def _show_rows(self, rows, text=""):
+        """Show a complete, unpaged result set (e.g. search results)."""
+        self._clear_tree()
+        self._set_overdue_day(None)
+        self._filter = None
+        self._search_text = text
+        self._set_sort_heading(None)  # ranked
+        self._first_no = 1
+        self._page_pending = False
+        for n, row in enumerate(rows, start=1):
+            self.tree.insert("", "end", iid=str(row["id"]), values=self._row_values(row, n))
+
+    def _clear_tree(self):
+        self.tree.delete(*self.tree.get_children())
+
+    def _row_values(self, row, row_no):
+        name = f"{row['firstname']} {row['surname']}"
+        return (row_no, row["member_type"], row["reference_no"], name, row["mobile"],
+                row["book_title"], row["author"], row["date_borrowed"], row["date_due"],
+                row["days_late"] if self._overdue_day is not None else row["days_on_loan"])
+
+    def _apply_change(self, change, in_view=False):
+        """Apply a RecordChange to the tree without reloading it.
+
+        Deleted rows are removed and the rows below renumbered; inserted rows
+        are appended if they belong to what is shown (in_view says whether
+        they pass the current filter), then moved to where they sort if a
+        heading sorts the rows. A sorted grid with rows beyond the listed
+        ones re-reads them instead. Scroll position and the current filter
+        or search are kept.
+        """
+        for rec_id in change.deleted_ids:
+            self._rows.discard(rec_id)
+            iid = str(rec_id)
+            if not self.tree.exists(iid):
+                continue
+            index = self.tree.index(iid)
+            self.tree.delete(iid)
+            self._overdue_total -= self._overdue_day is not None
+            for item in self.tree.get_children()[index:]:
+                self.tree.set(item, "id", int(self.tree.set(item, "id")) - 1)
+        inserted = reload = False
+        for row in change.inserted:
+            if self._overdue_day is not None:
+                # a loan entered with a past due date is already overdue
+                due = to_day(row["date_due"] or "")
+                if due is None or due >= self._overdue_day:
+                    continue
+                row = dict(row, days_late=self._overdue_day - due)
+                self._overdue_total += 1
+            elif self._filter is None:
+                if not record_matches_search(row, self._search_text):
+                    continue
+            else:
+                # new IDs sort last, so the row only shows once the last page is
+                # loaded; in a sorted grid it may belong among the listed rows
+                if not in_view or not (self._at_end or self._sort):
+                    continue
+                if self._sort and not self._shows_everything():
+                    reload = True
+                    continue
+            row_no = self._first_no + len(self.tree.get_children())
+            self.tree.insert("", "end", iid=str(row["id"]), values=self._row_values(row, row_no))
+            inserted = True
+        if self._overdue_day is not None:
+            self._set_overdue_day(self._overdue_day, self._overdue_total)
+        if reload:
+            self._reload_listed()
+        elif inserted and self._sort_heading is not None:
+            self._reorder(*self._sort_heading)
+
+    # ---------- Sorting ----------
+    def sort_by(self, col):
+        """Heading click: sort by that column; clicking it again reverses the order."""
+        sort = SORTABLE_HEADINGS[col]
+        descending = self._sort_heading == (col, False)
+        if self._filter is not None:
+            self._sort = {"sort": sort, "descending": descending}
+        if self._shows_everything():
+            self._reorder(col, descending)
+        elif self._filter is None:
+            messagebox.showinfo("Sort", f"Only the first {len(self.tree.get_children()):,} overdue loans "
+                                        "are listed, so they stay in due date order.")
+        else:
+            self._load_records(*self._filter)
+
+    def _reorder(self, col, descending):
+        """Put the listed rows in sort order without fetching them again.
+
+        Only their ids go to the database, which orders them by the same key
+        as fetch_page, so ties (same name, title or date) break the same way.
+        """
+        view_id = self._view_id
+        self._db_call("sort_ids", [int(item) for item in self.tree.get_children()], SORTABLE_HEADINGS[col],
+                      descending, channel="sort",
+                      callback=lambda ids: self._show_sorted(ids, col, descending, view_id))
+
+    def _reload_listed(self):
+        """Read the rows after the first listed one again, in sort order."""
+        items = self.tree.get_children()
+        if not items:
+            self._load_records(*self._filter)
+            return
+        first, limit, view_id = items[0], max(len(items) - 1, 1), self._view_id
+        self._db_call("fetch_page", after_id=int(first), limit=limit, columns=LIST_COLUMNS, **self._sort,
+                      channel="page", callback=lambda rows: self._replace_listed(first, rows, limit, view_id))
+
+    def _replace_listed(self, first, rows, limit, view_id):
+        self._page_pending = False  # a page load this call superseded
+        if view_id != self._view_id:
+            return
+        if not self.tree.exists(first):
+            self._load_records(*self._filter)  # deleted meanwhile: nothing to anchor on
+            return
+        top = self._top_index()
+        self.tree.delete(*self.tree.get_children()[1:])
+        self._at_end = len(rows) < limit
+        for n, row in enumerate(self._rows.put_many(rows), start=self._first_no + 1):
+            self.tree.insert("", "end", iid=str(row["id"]), values=self._row_values(row, n))
+        self._scroll_to_index(top)
+
+    def _show_sorted(self, ids, col, descending, view_id):
+        if view_id != self._view_id:
+            return
+        listed = set(self.tree.get_children())
+        n = 0
+        for rec_id in ids:
+            if str(rec_id) in listed:  # not deleted while the order was fetched
+                self.tree.move(str(rec_id), "", n)
+                self.tree.set(str(rec_id), "id", self._first_no + n)
+                n += 1
+        self._set_sort_heading(col, descending)
+
+    def _shows_everything(self):
+        """True if every row of the current view is in the tree."""
+        if self._overdue_day is not None:
+            return len(self.tree.get_children()) == self._overdue_total
+        if self._filter is None:
+            return True  # search results are never paged
+        return self._at_start and self._at_end
+
+    def _set_sort_heading(self, col, descending=False):
+        """Mark the heading the rows are sorted by (None: their natural order)."""
+        self._sort_heading = (col, descending) if col else None
+        for name in SORTABLE_HEADINGS:
+            arrow = (" \u25bc" if descending else " \u25b2") if name == col else ""
+            self.tree.heading(name, text=self._headings[name] + arrow)
+
+    # ---------- Overdue ----------
+    def show_overdue(self):
+        """List loans that are past due and not returned, most overdue first."""
+        self._view_id += 1
+        today = today_day()
+
+        def fetch(db):
+            return db.fetch_overdue(today, limit=MAX_TREE_ROWS, columns=LIST_COLUMNS), db.count_overdue(today)
+
+        self._db_call(fetch, channel="records", callback=lambda result: self._show_overdue(*result, today))
+
+    def _show_overdue(self, rows, total, today):
+        self._clear_tree()
+        self._filter = None
+        self._search_text = ""
+        self._set_sort_heading(None)  # by due date
+        self._first_no = 1
+        self._page_pending = False
+        self._set_overdue_day(today, total)
+        self._rows.put_many(rows)
+        for n, row in enumerate(rows, start=1):
+            self.tree.insert("", "end", iid=str(row["id"]), values=self._row_values(row, n))
+        self._set_overdue_day(today, total)  # again, for the shown count
+
+    def _set_overdue_day(self, day, total=0):
+        self._overdue_day = day
+        self._overdue_total = total
+        self.tree.heading("days", text="Days Late" if day is not None else "Days")
+        if day is None:
+            self.view_var.set("")
+            return
+        shown = len(self.tree.get_children())
+        note = f" (showing {shown})" if shown < total else ""
+        self.view_var.set(f"{total} overdue on {day_text(day)}{note}")
+
+    def _check_overdue_day(self):
+        """Move the Overdue view to a new date without reloading it.
+
+        Rows already listed just get older, so their days late grow by the
+        number of days passed; loans that fell due since are fetched on their
+        own and appended (they sort last). A truncated list is reloaded.
+        """
+        self.root.after(OVERDUE_CHECK_MS, self._check_overdue_day)
+        old, today = self._overdue_day, today_day()
+        if old is None or today == old:
+            return
+        if len(self.tree.get_children()) < self._overdue_total:
+            self.show_overdue()
+            return
+        view_id = self._view_id
+
+        def fetch(db):
+            rows = db.fetch_overdue(today, since=old, limit=MAX_TREE_ROWS, columns=LIST_COLUMNS)
+            return rows, db.count_overdue(today)
+
+        self._db_call(fetch, channel="overdue",
+                      callback=lambda result: self._advance_overdue(*result, today, view_id))
+
+    def _advance_overdue(self, rows, total, today, view_id):
+        if view_id != self._view_id or self._overdue_day is None:
+            return
+        items = self.tree.get_children()
+        if len(items) + len(rows) != total:
+            self.show_overdue()  # returns or deletes elsewhere; start over
+            return
+        delta = today - self._overdue_day
+        for item in items:
+            self.tree.set(item, "days", int(self.tree.set(item, "days")) + delta)
+        self._overdue_day = today
+        self._rows.put_many(rows)
+        for n, row in enumerate(rows, start=len(items) + 1):
+            self.tree.insert("", "end", iid=str(row["id"]), values=self._row_values(row, n))
+        self._set_overdue_day(today, total)
+        if self._sort_heading is not None:
+            self._reorder(*self._sort_heading)
+
+    def mark_returned(self):
+        sel = self.tree.selection()
+        if not sel:
+            messagebox.showwarning("Return", "Select a loan to mark as returned.")
+            return
+        rec_id = int(sel[0])
+        self._db_call("mark_returned", rec_id, callback=lambda ok: self._on_returned(rec_id, ok))
+
+    def _on_returned(self, rec_id, ok):
+        self._rows.discard(rec_id)  # its date_overdue may have been filled in
+        if not ok:
+            messagebox.showinfo("Return", "That loan is already marked as returned.")
+        elif self._overdue_day is not None:
+            self._apply_change(RecordChange([], [rec_id]))
+
+    def accrue_fines(self):
+        def run(db):
+            return db.accrue_fines(), db.fine_summary()
+
+        self._db_call(run, callback=lambda result: self._on_fines_accrued(*result))
+
+    def _on_fines_accrued(self, fine_run, summary):
+        lines = [f"{fine_run.loans} overdue loans, {money_text(fine_run.total_cents)} in fines "
+                 f"as of {day_text(fine_run.day)} ({fine_run.seconds:.1f}s)."]
+        if summary:
+            lines.append("")
+            lines.append("Largest balances:")
+        for member in summary[:FINE_SUMMARY_LINES]:
+            lines.append(f"{member.reference_no} {member.firstname} {member.surname}: "
+                         f"{money_text(member.fine_cents)} on {member.loans} loan(s)")
+        messagebox.showinfo("Fines", "\n".join(lines))
+
+    # ---------- Paging ----------
+    def _on_tree_scroll(self, first, last):
+        """Scrollbar callback: fetch the neighbouring page near either edge."""
+        self._vsb.set(first, last)
+        if self._filter is None or self._page_pending:
+            return
+        if float(last) > 0.9 and not self._at_end:
+            self._page_pending = True
+            self.root.after_idle(self._load_next_page)
+        elif float(first) < 0.1 and not self._at_start:
+            self._page_pending = True
+            self.root.after_idle(self._load_prev_page)
+
+    def _load_next_page(self):
+        items = self.tree.get_children()
+        if not items or self._filter is None:
+            self._page_pending = False
+            return
+        where_clause, params = self._filter
+        view_id = self._view_id
+        self._db_call("fetch_page", after_id=int(items[-1]), where_clause=where_clause, params=params,
+                      columns=LIST_COLUMNS, **self._sort, channel="page", callback=lambda rows: self._append_page(rows, view_id))
+
+    def _append_page(self, rows, view_id):
+        self._page_pending = False
+        if view_id != self._view_id:
+            return  # the grid was reloaded meanwhile
+        items = self.tree.get_children()
+        self._at_end = len(rows) < PAGE_SIZE
+        top = self._top_index()
+        next_no = self._first_no + len(items)
+        for n, row in enumerate(self._rows.put_many(rows), start=next_no):
+            self.tree.insert("", "end", iid=str(row["id"]), values=self._row_values(row, n))
+        # drop rows that scrolled far out of view above
+        extra = len(items) + len(rows) - MAX_TREE_ROWS
+        if extra > 0:
+            self.tree.delete(*items[:extra])
+            self._first_no += extra
+            self._at_start = False
+            self._scroll_to_index(top - extra)
+
+    def _load_prev_page(self):
+        items = self.tree.get_children()
+        if not items or self._filter is None:
+            self._page_pending = False
+            return
+        where_clause, params = self._filter
+        view_id = self._view_id
+        self._db_call("fetch_page", before_id=int(items[0]), where_clause=where_clause, params=params,
+                      columns=LIST_COLUMNS, **self._sort, channel="page", callback=lambda rows: self._prepend_page(rows, view_id))
+
+    def _prepend_page(self, rows, view_id):
+        self._page_pending = False
+        if view_id != self._view_id:
+            return
+        items = self.tree.get_children()
+        self._at_start = len(rows) < PAGE_SIZE
+        top = self._top_index()
+        self._first_no -= len(rows)
+        for n, row in enumerate(self._rows.put_many(rows)):
+            self.tree.insert("", n, iid=str(row["id"]), values=self._row_values(row, self._first_no + n))
+        # drop rows that scrolled far out of view below
+        extra = len(items) + len(rows) - MAX_TREE_ROWS
+        if extra > 0:
+            self.tree.delete(*items[len(items) - extra:])
+            self._at_end = False
+        self._scroll_to_index(top + len(rows))
+
+    def _top_index(self):
+        """Index of the first visible tree row."""
+        return round(self.tree.yview()[0] * len(self.tree.get_children()))
+
+    def _scroll_to_index(self, index):
+        total = len(self.tree.get_children())
+        if total:
+            self.tree.yview_moveto(max(index, 0) / total)
 
     def delete_selected(self):
         sel = self.tree.selection()
@@ -602,67 +896,142 @@ class LibraryApp:
             messagebox.showwarning("Delete", "Select a record to delete.")
             return
         rec_id = int(sel[0])
-        if messagebox.askyesno("Confirm Delete", f"Delete record ID {rec_id}?"):
-            self.db.delete_by_id(rec_id)
-            self._load_records()
+        row_no = self.tree.set(sel[0], "id")
+        if messagebox.askyesno("Confirm Delete", f"Delete record No. {row_no}?"):
+            self._db_call("remove_record", rec_id, callback=self._apply_change)
+
+    def _on_search_typed(self, *_):
+        # the running search is for text the user has already changed
+        self._cancel_search()
+        if self._search_after is not None:
+            self.root.after_cancel(self._search_after)
+        self._search_after = self.root.after(SEARCH_DEBOUNCE_MS, self.search_records)
+
+    def _cancel_search(self):
+        """Drop or interrupt the search running on the worker, and ignore its result."""
+        if self._search_future is not None:
+            self.worker.cancel(self._search_future)
+            self._search_future = None
+            self._latest["records"] = next(self._tokens)  # an interrupted search fails; not an error
 
     def search_records(self):
+        """Search now; repeated and narrowing queries are served from the cache."""
+        if self._search_after is not None:
+            self.root.after_cancel(self._search_after)
+            self._search_after = None
+        self._cancel_search()
         q = self.search_var.get().strip()
         if not q:
             self._load_records()
             return
-        clause = "firstname LIKE ? OR surname LIKE ? OR book_title LIKE ? OR reference_no LIKE ?"
-        like_q = f"%{q}%"
-        self._load_records(where_clause=clause, params=(like_q, like_q, like_q, like_q))
+        self._view_id += 1
+        rows = self._search_cache.get(q, self.worker.generation)
+        if rows is not None:
+            self._latest["records"] = next(self._tokens)  # drop any older result still in flight
+            self._show_rows(rows, q)
+            return
+
+        def search(db):
+            return db.search(q, columns=LIST_COLUMNS), db.generation
+
+        self._search_future = self._db_call(
+            search, channel="records", callback=lambda result: self._on_search_done(q, *result))
+
+    def _on_search_done(self, q, rows, generation):
+        self._search_future = None
+        rows = self._rows.put_many(rows)  # the cache shares the stored rows
+        self._search_cache.put(q, rows, generation)
+        self._show_rows(rows, q)
 
     def export_csv(self):
-        rows = self.db.fetch_all()
-        if not rows:
+        self._db_call("fetch_page", limit=1, columns=("id",), callback=self._choose_export_file)
+
+    def _choose_export_file(self, first_rows):
+        if not first_rows:
             messagebox.showinfo("Export", "No records to export.")
             return
         file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
         if not file_path:
             return
-        headers = ["id", "member_type", "reference_no", "title", "firstname", "surname", "mobile",
-                   "address1", "address2", "postcode", "book_id", "book_title", "author",
-                   "date_borrowed", "date_due", "days_on_loan", "late_return_fine",
-                   "selling_price", "date_overdue", "created_at"]
-        with open(file_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(headers)
-            writer.writerows(rows)
-        messagebox.showinfo("Exported", f"Records exported to {os.path.abspath(file_path)}")
+        job = BackgroundJob(export_records, self.worker.db_path, file_path)
+        ProgressDialog(self.root, "Exporting CSV", job, lambda job: self._on_export_done(job, file_path))
+
+    def _on_export_done(self, job, file_path):
+        if job.error:
+            messagebox.showerror("Export Failed", str(job.error))
+        elif job.result is None:
+            messagebox.showinfo("Export", "Export cancelled.")
+        else:
+            messagebox.showinfo("Exported", f"{job.result:,} records exported to {os.path.abspath(file_path)}")
+
+    def import_csv(self):
+        file_path = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
+        if not file_path:
+            return
+        keep_ids = messagebox.askyesnocancel(
+            "Import CSV", "Keep the IDs from the file?\n\nYes: keep them (rows whose ID is taken are skipped)\nNo: assign new IDs")
+        if keep_ids is None:
+            return
+        job = BackgroundJob(import_records, self.worker.db_path, file_path, keep_ids)
+        ProgressDialog(self.root, "Importing CSV", job, self._on_import_done)
+
+    def _on_import_done(self, job):
+        if job.error:
+            messagebox.showerror("Import Failed", str(job.error))
+            return
+        res = job.result
+        rate = res.read / res.seconds if res.seconds else 0
+        msg = (f"Read {res.read:,} rows in {res.seconds:.1f}s ({rate:,.0f} rows/s)\n"
+               f"Inserted: {res.inserted:,}\nDuplicates skipped: {res.duplicates:,}\n"
+               f"Rejected: {res.rejected:,}")
+        if res.errors:
+            msg += "\n\n" + "\n".join(res.errors[:5])
+        if job.cancelled:
+            msg = "Import cancelled.\n\n" + msg
+        messagebox.showinfo("Import", msg)
+        self._search_cache.clear()  # the import wrote through its own connection
+        self._rows.clear()
+        self._load_records()
 
     def _on_tree_double_click(self, event):
         item = self.tree.identify_row(event.y)
         if not item:
             return
         rec_id = int(item)
-        rows = self.db.fetch_all("id = ?", (rec_id,))
-        if rows:
-            r = rows[0]
-            self.member_type.set(r[1])
-            self.reference.set(r[2])
-            self.title.set(r[3])
-            self.firstname.set(r[4])
-            self.surname.set(r[5])
-            self.mobile.set(r[6])
-            self.address1.set(r[7])
-            self.address2.set(r[8])
-            self.postcode.set(r[9])
-            self.book_id.set(r[10])
-            self.book_title.set(r[11])
-            self.author.set(r[12])
-            self.date_borrowed.set(r[13])
-            self.date_due.set(r[14])
-            self.days_on_loan.set(r[15] if r[15] else 14)
-            self.late_return_fine.set(r[16])
-            self.selling_price.set(r[17])
-            self.date_overdue.set(r[18])
+        row = self._rows.get(rec_id)
+        if row is not None and row.complete:
+            self._latest["detail"] = next(self._tokens)  # drop any older lookup still in flight
+            self._fill_form(row)
+            return
+        self._db_call("fetch_by_id", rec_id, channel="detail", callback=self._on_detail_loaded)
+
+    def _on_detail_loaded(self, row):
+        if row is not None:
+            self._fill_form(self._rows.put(row))
+
+    def _fill_form(self, r):
+        self.member_type.set(r["member_type"])
+        self.reference.set(r["reference_no"])
+        self.title.set(r["title"])
+        self.firstname.set(r["firstname"])
+        self.surname.set(r["surname"])
+        self.mobile.set(r["mobile"])
+        self.address1.set(r["address1"])
+        self.address2.set(r["address2"])
+        self.postcode.set(r["postcode"])
+        self.book_id.set(r["book_id"])
+        self.book_title.set(r["book_title"])
+        self.author.set(r["author"])
+        self.date_borrowed.set(r["date_borrowed"])
+        self.date_due.set(r["date_due"])
+        self.days_on_loan.set(r["days_on_loan"] if r["days_on_loan"] else 14)
+        self.late_return_fine.set(r["late_return_fine"])
+        self.selling_price.set(r["selling_price"])
+        self.date_overdue.set(r["date_overdue"])
 
     def _on_exit(self):
         if messagebox.askyesno("Exit", "Are you sure you want to quit?"):
-            self.db.close()
+            self.worker.close()
             self.root.destroy()
 
 
@@ -670,18 +1039,35 @@ class LibraryApp:
 # MAIN PROGRAM
 # =========================
 def main():
+    if "--accrue-fines" in sys.argv[1:]:
+        # kept for existing cron entries; same as "library_cli.py fines"
+        import library_cli
+        sys.exit(library_cli.main(["fines"]))
+    if "--timing" in sys.argv[1:]:
+        enable_startup_timing()
+    if "--trace-sql" in sys.argv[1:]:
+        enable_tracing()
+    mark_startup("imports")
     root = tk.Tk()
     root.title("Library System Login")
     root.geometry("400x200")
 
+    # open the records database and load the first page while the user logs in
+    worker = DatabaseWorker()
+    prefetch = prefetch_dashboard(worker)
+
     def show_library_dashboard():
         root.geometry("1150x700")
-        LibraryApp(root)
+        LibraryApp(root, worker, prefetch)
 
     login_frame = LoginFrame(root, show_library_dashboard)
     login_frame.pack(expand=True, fill="both")
+    root.after_idle(lambda: mark_startup("login painted"))
 
     root.mainloop()
+    worker.close()
+    if SQL_STATS.enabled:
+        SQL_STATS.report()
 
 if __name__ == "__main__":
     main()